@@ -1,15 +1,58 @@
+# eventlet must patch the stdlib before anything else is imported
+try:
+    import eventlet
+    eventlet.monkey_patch()
+    ASYNC_MODE = 'eventlet'
+except ImportError:
+    ASYNC_MODE = 'threading'
+
 from flask import Flask, render_template, jsonify, request
 from flask_socketio import SocketIO
 import csv
 import os
+import sys
 import time
 import json
-from threading import Thread
+import queue
+import logging
+import logging.handlers
+from threading import Lock
+from collections import Counter, deque
+from functools import lru_cache
 from datetime import datetime, timedelta
 import re
 
+try:
+    import pandas as pd
+except ImportError:
+    pd = None
+
+try:
+    import inotify.adapters
+    import inotify.constants
+except ImportError:
+    inotify = None
+
+if ASYNC_MODE == 'eventlet' and inotify is not None:
+    from eventlet import tpool
+    # monkey_patch strips epoll from select; the adapter's blocking wait runs on a
+    # real OS thread (see inotify_events), so hand it the unpatched module
+    inotify.adapters.select = eventlet.patcher.original('select')
+
+# Diagnostics go through a queue so formatting and stderr writes happen on a
+# background thread; Flask's own logging is left alone
+log = logging.getLogger('parking.app')
+log.setLevel(os.environ.get('LOG_LEVEL', 'WARNING').upper())
+log.propagate = False
+log_queue = queue.Queue(-1)
+log.addHandler(logging.handlers.QueueHandler(log_queue))
+_log_stream = logging.StreamHandler()
+_log_stream.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(message)s'))
+log_listener = logging.handlers.QueueListener(log_queue, _log_stream)
+log_listener.start()
+
 app = Flask(__name__)
-socketio = SocketIO(app, cors_allowed_origins="*")
+socketio = SocketIO(app, cors_allowed_origins="*", async_mode=ASYNC_MODE)
 
 # File paths
 CSV_FILE = 'plates_log.csv'
@@ -28,16 +71,51 @@ system_stats = {
     "hourly_rate": 200
 }
 
+# In-memory model behind system_stats, kept current by the log watcher
+_entries = {}             # plate -> latest payment status
+_exited = set()           # plates seen in the exit log
+_unpaid_rows = Counter()  # plate -> number of unpaid entry rows
+
+# Dashboard events are coalesced and sent at most once per EMIT_INTERVAL seconds
+EMIT_INTERVAL = 0.1
+emit_queue = queue.Queue()
+
 # Activity tracking
-recent_activities = []
 MAX_ACTIVITIES = 50
+recent_activities = deque(maxlen=MAX_ACTIVITIES)
+
+# Header row for each CSV log, written when the file is first created
+LOG_HEADERS = {
+    CSV_FILE: ['Plate Number', 'Payment Status', 'Timestamp'],
+    EXIT_LOG: ['Plate Number', 'Entry Time', 'Exit Time', 'Duration', 'Amount Paid'],
+    SECURITY_LOG_FILE: ['Timestamp', 'Plate Number', 'Alert Type', 'Status', 'Action Taken', 'Personnel Notified'],
+}
+
+# Long-lived append handles: path -> (csv writer, lock)
+_log_writers = {}
+_log_writers_lock = Lock()
+
+def get_log_writer(path):
+    """Return the (csv writer, lock) pair appending to path, creating the file with its header"""
+    with _log_writers_lock:
+        if path not in _log_writers:
+            # Line-buffered so every row reaches the file as soon as it is written
+            f = open(path, 'a', newline='', buffering=1)
+            writer = csv.writer(f)
+            if f.tell() == 0 and path in LOG_HEADERS:
+                writer.writerow(LOG_HEADERS[path])
+            _log_writers[path] = (writer, Lock())
+        return _log_writers[path]
+
+def append_log_row(path, row):
+    """Append one row to a CSV log through its cached writer"""
+    writer, lock = get_log_writer(path)
+    with lock:
+        writer.writerow(row)
 
 def create_exit_log_if_not_exists():
     """Create exit log file with headers if it doesn't exist"""
-    if not os.path.exists(EXIT_LOG):
-        with open(EXIT_LOG, 'w', newline='') as f:
-            writer = csv.writer(f)
-            writer.writerow(['Plate Number', 'Entry Time', 'Exit Time', 'Duration', 'Amount Paid'])
+    get_log_writer(EXIT_LOG)
 
 def log_activity(activity_type, plate_number, details="", status="INFO"):
     """Log system activities for real-time monitoring"""
@@ -50,193 +128,400 @@ def log_activity(activity_type, plate_number, details="", status="INFO"):
         'status': status  # 'SUCCESS', 'ERROR', 'WARNING', 'INFO'
     }
     
-    recent_activities.insert(0, activity)
-    if len(recent_activities) > MAX_ACTIVITIES:
-        recent_activities.pop()
+    recent_activities.appendleft(activity)
     
-    # Emit to all connected clients
-    socketio.emit('new_activity', activity)
+    # Emit to all connected clients with the next batch
+    queue_emit('activities', activity)
 
-def update_system_stats():
-    """Update comprehensive system statistics"""
+def queue_emit(kind, payload):
+    """Queue a dashboard event ('activities', 'transactions' or 'security_alerts') for the next batch"""
+    emit_queue.put((kind, payload))
+
+def emit_batches():
+    """Every EMIT_INTERVAL seconds, send all queued events plus current stats as one batch_update"""
+    while True:
+        time.sleep(EMIT_INTERVAL)
+        batch = {'activities': [], 'transactions': [], 'security_alerts': []}
+        while True:
+            try:
+                kind, payload = emit_queue.get_nowait()
+            except queue.Empty:
+                break
+            batch[kind].append(payload)
+        
+        if any(batch.values()):
+            batch['stats'] = system_stats
+            socketio.emit('batch_update', batch)
+
+@lru_cache(maxsize=4096)
+def parse_timestamp(timestamp):
+    """Parse a log timestamp; plates keep their entry time, so repeats hit the cache"""
+    return datetime.strptime(timestamp, '%Y-%m-%d %H:%M:%S')
+
+@lru_cache(maxsize=8)
+def _read_csv_cached(path, mtime, size):
+    with open(path, 'r') as f:
+        return list(csv.DictReader(f))
+
+@lru_cache(maxsize=2)
+def _read_lines_cached(path, mtime, size):
+    with open(path, 'r') as f:
+        return [line.strip() for line in f if line.strip()]
+
+@lru_cache(maxsize=8)
+def _read_columns_cached(path, mtime, size, columns):
+    if pd is not None:
+        try:
+            frame = pd.read_csv(path, usecols=list(columns), dtype=str,
+                                keep_default_na=False, index_col=False, engine='c')
+            return tuple(frame[column].tolist() for column in columns)
+        except ValueError:
+            pass  # Ragged or empty file, let the csv module deal with it
+    rows = _read_csv_cached(path, mtime, size)
+    return tuple([row[column] for row in rows] for column in columns)
+
+def read_csv_rows(path):
+    """Parsed rows of a CSV log, shared between callers until the file's mtime or size changes.
+    
+    Raises FileNotFoundError if the file is missing. Callers must not mutate the result.
+    """
+    st = os.stat(path)
+    return _read_csv_cached(path, st.st_mtime_ns, st.st_size)
+
+def read_log_lines(path):
+    """Non-empty stripped lines of a text log, cached like read_csv_rows"""
+    st = os.stat(path)
+    return _read_lines_cached(path, st.st_mtime_ns, st.st_size)
+
+def read_csv_columns(path, *columns):
+    """Whole columns of a CSV log as lists, parsed with pandas' C reader when available.
+    
+    Cached like read_csv_rows; raises FileNotFoundError if the file is missing.
+    """
+    st = os.stat(path)
+    return _read_columns_cached(path, st.st_mtime_ns, st.st_size, columns)
+
+def rebuild_stats():
+    """Rebuild the stats model from a full read of the entry and exit logs"""
     try:
-        vehicles = set()
-        paid_count = 0
-        pending_count = 0
-        entry_times = {}
-        exited_vehicles = set()
+        plates, statuses = [], []
+        exited = set()
         
         # Process entry logs
         if os.path.exists(CSV_FILE):
-            with open(CSV_FILE, 'r') as f:
-                reader = csv.DictReader(f)
-                for row in reader:
-                    plate = row['Plate Number']
-                    vehicles.add(plate)
-                    entry_times[plate] = row['Timestamp']
-                    
-                    if row['Payment Status'] == '1':
-                        paid_count += 1
-                    else:
-                        pending_count += 1
+            plates, statuses = read_csv_columns(CSV_FILE, 'Plate Number', 'Payment Status')
+            plates = list(map(sys.intern, plates))
+        
+        entries = dict(zip(plates, statuses))
+        paid_count = statuses.count('1')
+        pending_count = len(statuses) - paid_count
+        unpaid_rows = Counter(plate for plate, status in zip(plates, statuses) if status != '1')
         
         # Process exit logs
         if os.path.exists(EXIT_LOG):
-            with open(EXIT_LOG, 'r') as f:
-                reader = csv.DictReader(f)
-                for row in reader:
-                    exited_vehicles.add(row['Plate Number'])
-        
-        # Calculate vehicles still inside
-        vehicles_inside = len(vehicles - exited_vehicles)
+            exited = set(map(sys.intern, read_csv_columns(EXIT_LOG, 'Plate Number')[0]))
         
-      
+        _entries.clear()
+        _entries.update(entries)
+        _exited.clear()
+        _exited.update(exited)
+        _unpaid_rows.clear()
+        _unpaid_rows.update(unpaid_rows)
         
-        # Calculate active sessions (vehicles inside with pending payments)
-        active_sessions = 0
-        for plate in vehicles:
-            if plate not in exited_vehicles:
-                # Check if payment is pending
-                with open(CSV_FILE, 'r') as f:
-                    reader = csv.DictReader(f)
-                    for row in reader:
-                        if row['Plate Number'] == plate and row['Payment Status'] == '0':
-                            active_sessions += 1
-                            break
-        
-        # Update stats
+        # Active sessions are vehicles inside whose latest entry is unpaid
         system_stats.update({
-            "total_vehicles": len(vehicles),
-            "vehicles_inside": vehicles_inside,
+            "total_vehicles": len(entries),
+            "vehicles_inside": len(entries.keys() - exited),
             "paid_vehicles": paid_count,
             "pending_payments": pending_count,
-            "vehicles_exited": len(exited_vehicles),
-            "active_sessions": active_sessions
+            "vehicles_exited": len(exited),
+            "active_sessions": sum(1 for plate, status in entries.items()
+                                   if plate not in exited and status == '0')
         })
         
     except Exception as e:
-        print(f"Error updating stats: {e}")
+        log.error("Error updating stats: %s", e)
 
-def watch_logs():
-    """Enhanced log monitoring for all system components including security alerts"""
-    last_csv_size = 0
-    last_payment_size = 0
-    last_exit_size = 0
-    last_security_size = 0  # NEW: Track security alerts
+def apply_entry_lines(lines):
+    """Count new entry rows into the stats model"""
+    for line in lines:
+        parts = line.split(',')
+        if len(parts) < 3:
+            continue
+        plate, status = sys.intern(parts[0]), parts[1]
+        previous = _entries.get(plate)
+        _entries[plate] = status
+        
+        if status == '1':
+            system_stats['paid_vehicles'] += 1
+        else:
+            system_stats['pending_payments'] += 1
+            _unpaid_rows[plate] += 1
+        
+        if previous is None:
+            system_stats['total_vehicles'] += 1
+            if plate not in _exited:
+                system_stats['vehicles_inside'] += 1
+        if plate not in _exited:
+            system_stats['active_sessions'] += (status == '0') - (previous == '0')
+
+def apply_payment_lines(lines):
+    """Mark every unpaid row of a plate as paid on a successful payment"""
+    for line in lines:
+        parts = line.split(' - ')
+        if len(parts) < 3 or 'SUCCESS' not in parts[2]:
+            continue
+        plate = sys.intern(parts[1])
+        settled = _unpaid_rows.pop(plate, 0)
+        system_stats['pending_payments'] -= settled
+        system_stats['paid_vehicles'] += settled
+        
+        if _entries.get(plate) == '0':
+            _entries[plate] = '1'
+            if plate not in _exited:
+                system_stats['active_sessions'] -= 1
+
+def apply_exit_lines(lines):
+    """Count new exits into the stats model"""
+    for line in lines:
+        plate = sys.intern(line.split(',')[0])
+        if not plate or plate in _exited:
+            continue
+        _exited.add(plate)
+        system_stats['vehicles_exited'] += 1
+        
+        if plate in _entries:
+            system_stats['vehicles_inside'] -= 1
+            if _entries[plate] == '0':
+                system_stats['active_sessions'] -= 1
+
+def update_system_stats():
+    """Return current system statistics.
     
-    while True:
-        try:
-            # Monitor entry logs
-            current_csv_size = os.path.getsize(CSV_FILE) if os.path.exists(CSV_FILE) else 0
-            if current_csv_size != last_csv_size:
-                update_system_stats()
-                
-                # Check for new entries
-                if os.path.exists(CSV_FILE):
-                    with open(CSV_FILE, 'r') as f:
-                        lines = f.readlines()
-                        if len(lines) > 1:  # Skip header
-                            last_line = lines[-1].strip()
-                            parts = last_line.split(',')
-                            if len(parts) >= 3:
-                                plate = parts[0]
-                                timestamp = parts[2]
-                                log_activity('ENTRY', plate, f'Vehicle entered at {timestamp}', 'SUCCESS')
-                
-                socketio.emit('stats_update', system_stats)
-                last_csv_size = current_csv_size
-            
-            # Monitor payment logs
-            current_payment_size = os.path.getsize(PAYMENT_LOG) if os.path.exists(PAYMENT_LOG) else 0
-            if current_payment_size != last_payment_size:
-                if os.path.exists(PAYMENT_LOG):
-                    with open(PAYMENT_LOG, 'r') as f:
-                        lines = f.readlines()
-                        if lines:
-                            last_line = lines[-1].strip()
-                            
-                            # Parse payment log entry
-                            if ' - ' in last_line:
-                                parts = last_line.split(' - ')
-                                if len(parts) >= 3:
-                                    timestamp = parts[0]
-                                    plate = parts[1]
-                                    status_info = parts[2]
-                                    
-                                    if 'SUCCESS' in status_info:
-                                        log_activity('PAYMENT', plate, 'Payment processed successfully', 'SUCCESS')
-                                    elif 'INSUFFICIENT' in status_info:
-                                        log_activity('PAYMENT', plate, 'Insufficient balance', 'WARNING')
-                                    elif 'ERROR' in status_info:
-                                        log_activity('PAYMENT', plate, 'Payment processing error', 'ERROR')
-                                    else:
-                                        log_activity('PAYMENT', plate, status_info, 'INFO')
-                            
-                            socketio.emit('new_transaction', {
-                                'log': last_line,
-                                'type': 'payment',
-                                'stats': system_stats
-                            })
-                
-                update_system_stats()
-                socketio.emit('stats_update', system_stats)
-                last_payment_size = current_payment_size
-            
-            # Monitor exit logs
-            current_exit_size = os.path.getsize(EXIT_LOG) if os.path.exists(EXIT_LOG) else 0
-            if current_exit_size != last_exit_size:
-                if os.path.exists(EXIT_LOG):
-                    with open(EXIT_LOG, 'r') as f:
-                        lines = f.readlines()
-                        if len(lines) > 1:  # Skip header
-                            last_line = lines[-1].strip()
-                            parts = last_line.split(',')
-                            if len(parts) >= 4:
-                                plate = parts[0]
-                                exit_time = parts[2]
-                                duration = parts[3] if len(parts) > 3 else 'N/A'
-                                log_activity('EXIT', plate, f'Vehicle exited after {duration}', 'SUCCESS')
+    They are maintained incrementally while the log watcher runs; without it
+    (e.g. imported by a WSGI server) they are rebuilt on request instead.
+    """
+    if not watcher_running:
+        rebuild_stats()
+    return system_stats
+
+def handle_entry_log_change(lines):
+    """Report new vehicle entries"""
+    for line in lines:
+        parts = line.split(',')
+        if len(parts) >= 3:
+            plate = parts[0]
+            timestamp = parts[2]
+            log_activity('ENTRY', plate, f'Vehicle entered at {timestamp}', 'SUCCESS')
+
+def handle_payment_log_change(lines):
+    """Report new payment transactions"""
+    for line in lines:
+        # Parse payment log entry
+        if ' - ' in line:
+            parts = line.split(' - ')
+            if len(parts) >= 3:
+                timestamp = parts[0]
+                plate = parts[1]
+                status_info = parts[2]
                 
-                update_system_stats()
-                socketio.emit('stats_update', system_stats)
-                last_exit_size = current_exit_size
+                if 'SUCCESS' in status_info:
+                    log_activity('PAYMENT', plate, 'Payment processed successfully', 'SUCCESS')
+                elif 'INSUFFICIENT' in status_info:
+                    log_activity('PAYMENT', plate, 'Insufficient balance', 'WARNING')
+                elif 'ERROR' in status_info:
+                    log_activity('PAYMENT', plate, 'Payment processing error', 'ERROR')
+                else:
+                    log_activity('PAYMENT', plate, status_info, 'INFO')
+        
+        queue_emit('transactions', {
+            'log': line,
+            'type': 'payment'
+        })
+
+def handle_exit_log_change(lines):
+    """Report new vehicle exits"""
+    for line in lines:
+        parts = line.split(',')
+        if len(parts) >= 4:
+            plate = parts[0]
+            exit_time = parts[2]
+            duration = parts[3] if len(parts) > 3 else 'N/A'
+            log_activity('EXIT', plate, f'Vehicle exited after {duration}', 'SUCCESS')
+
+def handle_security_log_change(lines):
+    """Forward new security alerts to the dashboard"""
+    for line in lines:
+        parts = line.split(',')
+        if len(parts) >= 6:
+            timestamp = parts[0]
+            plate = parts[1]
+            alert_type = parts[2]
+            action_taken = parts[4]
             
-            # NEW: Monitor security alerts
-            current_security_size = os.path.getsize(SECURITY_LOG_FILE) if os.path.exists(SECURITY_LOG_FILE) else 0
-            if current_security_size != last_security_size:
-                if os.path.exists(SECURITY_LOG_FILE):
-                    with open(SECURITY_LOG_FILE, 'r') as f:
-                        lines = f.readlines()
-                        if len(lines) > 1:  # Skip header
-                            last_line = lines[-1].strip()
-                            parts = last_line.split(',')
-                            if len(parts) >= 6:
-                                timestamp = parts[0]
-                                plate = parts[1]
-                                alert_type = parts[2]
-                                action_taken = parts[4]
-                                
-                                # Create security alert for dashboard
-                                security_alert = {
-                                    'timestamp': timestamp,
-                                    'type': 'SECURITY_ALERT',
-                                    'plate': plate,
-                                    'details': f'{alert_type}: {action_taken}',
-                                    'status': 'ERROR',
-                                    'alert_type': alert_type
-                                }
-                                
-                                # Emit to dashboard
-                                socketio.emit('security_alert', security_alert)
-                                log_activity('SECURITY_ALERT', plate, f'{alert_type} - {action_taken}', 'ERROR')
-                
-                last_security_size = current_security_size
+            # Create security alert for dashboard
+            security_alert = {
+                'timestamp': timestamp,
+                'type': 'SECURITY_ALERT',
+                'plate': plate,
+                'details': f'{alert_type}: {action_taken}',
+                'status': 'ERROR',
+                'alert_type': alert_type
+            }
             
+            # Emit to dashboard
+            queue_emit('security_alerts', security_alert)
+            log_activity('SECURITY_ALERT', plate, f'{alert_type} - {action_taken}', 'ERROR')
+
+# Per-file handlers, keyed by the watched path
+LOG_HANDLERS = {
+    CSV_FILE: handle_entry_log_change,
+    PAYMENT_LOG: handle_payment_log_change,
+    EXIT_LOG: handle_exit_log_change,
+    SECURITY_LOG_FILE: handle_security_log_change,
+}
+
+# Incremental stats updaters; logs not listed here carry no stats
+STATS_UPDATERS = {
+    CSV_FILE: apply_entry_lines,
+    PAYMENT_LOG: apply_payment_lines,
+    EXIT_LOG: apply_exit_lines,
+}
+
+# Set once watch_logs has primed the stats; until then requests rebuild them
+watcher_running = False
+
+# Logs whose first line is a CSV header rather than an event
+LOGS_WITH_HEADER = {CSV_FILE, EXIT_LOG, SECURITY_LOG_FILE}
+
+def read_new_lines(path, last_offsets):
+    """Return (lines, resync) for complete lines appended to path since the stored byte offset.
+    
+    A read starting at offset 0 (first read, or the file was truncated and
+    rewritten) is a resync: it only reports the newest line, like the old
+    last-line check.
+    """
+    try:
+        f = open(path, 'rb')
+    except FileNotFoundError:
+        last_offsets[path] = 0
+        return [], False
+    
+    with f:
+        size = os.fstat(f.fileno()).st_size
+        offset = last_offsets.get(path, 0)
+        if size < offset:
+            offset = 0
+        if size == offset:
+            last_offsets[path] = offset
+            return [], False
+        f.seek(offset)
+        chunk = f.read()
+    
+    # Leave a partially written last line for the next event
+    end = chunk.rfind(b'\n') + 1
+    last_offsets[path] = offset + end
+    
+    lines = [line.decode('utf-8', errors='replace').strip() for line in chunk[:end].split(b'\n')]
+    lines = [line for line in lines if line]
+    if offset == 0:
+        if path in LOGS_WITH_HEADER:
+            lines = lines[1:]
+        lines = lines[-1:]
+    return lines, offset == 0
+
+def dispatch_log_change(path, last_offsets):
+    """Update stats and run the handler for path with any lines appended since the last call"""
+    lines, resync = read_new_lines(path, last_offsets)
+    if path in STATS_UPDATERS:
+        if resync:
+            rebuild_stats()
+        else:
+            STATS_UPDATERS[path](lines)
+    if lines:
+        LOG_HANDLERS[path](lines)
+
+def prime_log_watch(last_offsets):
+    """Rebuild the stats once and bring every log's offset up to date.
+    
+    Each log's first read is a resync; handling them here keeps that to a
+    single stats rebuild instead of one per log.
+    """
+    global watcher_running
+    rebuild_stats()
+    for path in LOG_HANDLERS:
+        try:
+            lines, _ = read_new_lines(path, last_offsets)
+            if lines:
+                LOG_HANDLERS[path](lines)
+        except Exception as e:
+            log.error("Log watcher error: %s", e)
+    watcher_running = True
+
+def poll_logs(last_offsets):
+    """Fallback watcher: check every log once per second"""
+    while True:
+        try:
+            for path in LOG_HANDLERS:
+                dispatch_log_change(path, last_offsets)
             time.sleep(1)
         except Exception as e:
-            print(f"Log watcher error: {str(e)}")
+            log.error("Log watcher error: %s", e)
             time.sleep(5)
 
+def inotify_events(notifier):
+    """Yield inotify events without stalling the eventlet hub.
+    
+    Under eventlet each blocking wait runs on a tpool OS thread and the event
+    is handed back to the calling green thread; otherwise events come straight
+    from the adapter.
+    """
+    events = notifier.event_gen(yield_nones=False)
+    if ASYNC_MODE != 'eventlet':
+        yield from events
+        return
+    while True:
+        try:
+            yield tpool.execute(next, events)
+        except StopIteration:
+            return
+
+def watch_logs():
+    """Enhanced log monitoring for all system components including security alerts.
+    
+    Sleeps on inotify events when available so the thread only wakes on real
+    writes; falls back to stat-polling otherwise.
+    """
+    last_offsets = {}
+    prime_log_watch(last_offsets)
+    
+    if inotify is None:
+        log.warning("inotify not available, polling log files")
+        poll_logs(last_offsets)
+        return
+    
+    try:
+        notifier = inotify.adapters.Inotify()
+        for path in LOG_HANDLERS:
+            notifier.add_watch(path, mask=inotify.constants.IN_MODIFY | inotify.constants.IN_CLOSE_WRITE)
+    except Exception as e:
+        log.warning("inotify setup failed (%s), polling log files", e)
+        poll_logs(last_offsets)
+        return
+    
+    # Catch up on anything written before the watches were registered
+    for path in LOG_HANDLERS:
+        try:
+            dispatch_log_change(path, last_offsets)
+        except Exception as e:
+            log.error("Log watcher error: %s", e)
+    
+    for _, _, path, _ in inotify_events(notifier):
+        try:
+            dispatch_log_change(path, last_offsets)
+        except Exception as e:
+            log.error("Log watcher error: %s", e)
+
 # Routes
 @app.route('/')
 def index():
@@ -248,13 +533,9 @@ def get_logs():
     """Get entry logs"""
     logs = []
     try:
-        with open(CSV_FILE, 'r') as f:
-            reader = csv.DictReader(f)
-            logs = [row for row in reader]
+        logs = read_csv_rows(CSV_FILE)
     except FileNotFoundError:
-        with open(CSV_FILE, 'w', newline='') as f:
-            writer = csv.writer(f)
-            writer.writerow(['Plate Number', 'Payment Status', 'Timestamp'])
+        get_log_writer(CSV_FILE)
     return jsonify(logs)
 
 @app.route('/transactions')
@@ -262,10 +543,9 @@ def get_transactions():
     """Get payment transaction logs"""
     transactions = []
     try:
-        with open(PAYMENT_LOG, 'r') as f:
-            transactions = [line.strip() for line in f.readlines() if line.strip()]
+        transactions = read_log_lines(PAYMENT_LOG)
     except FileNotFoundError:
-        open(PAYMENT_LOG, 'w').close()
+        get_log_writer(PAYMENT_LOG)
     return jsonify(transactions)
 
 @app.route('/exits')
@@ -273,9 +553,7 @@ def get_exits():
     """Get exit logs"""
     exits = []
     try:
-        with open(EXIT_LOG, 'r') as f:
-            reader = csv.DictReader(f)
-            exits = [row for row in reader]
+        exits = read_csv_rows(EXIT_LOG)
     except FileNotFoundError:
         create_exit_log_if_not_exists()
     return jsonify(exits)
@@ -283,7 +561,7 @@ def get_exits():
 @app.route('/activities')
 def get_activities():
     """Get recent system activities"""
-    return jsonify(recent_activities)
+    return jsonify(list(recent_activities))
 
 @app.route('/stats')
 def get_stats():
@@ -301,38 +579,32 @@ def get_vehicles_inside():
         
         # Get all entries
         if os.path.exists(CSV_FILE):
-            with open(CSV_FILE, 'r') as f:
-                reader = csv.DictReader(f)
-                for row in reader:
-                    entered_vehicles[row['Plate Number']] = {
-                        'entry_time': row['Timestamp'],
-                        'payment_status': row['Payment Status']
-                    }
+            plates, timestamps, statuses = read_csv_columns(
+                CSV_FILE, 'Plate Number', 'Timestamp', 'Payment Status')
+            # Latest entry per plate wins
+            entered_vehicles = dict(zip(plates, zip(timestamps, statuses)))
         
         # Get all exits
         if os.path.exists(EXIT_LOG):
-            with open(EXIT_LOG, 'r') as f:
-                reader = csv.DictReader(f)
-                for row in reader:
-                    exited_vehicles.add(row['Plate Number'])
+            exited_vehicles = set(read_csv_columns(EXIT_LOG, 'Plate Number')[0])
         
         # Calculate vehicles still inside
-        for plate, info in entered_vehicles.items():
+        for plate, (entry_time_str, payment_status) in entered_vehicles.items():
             if plate not in exited_vehicles:
-                entry_time = datetime.strptime(info['entry_time'], '%Y-%m-%d %H:%M:%S')
+                entry_time = parse_timestamp(entry_time_str)
                 duration = datetime.now() - entry_time
                 hours = duration.total_seconds() / 3600
                 
                 vehicles_inside.append({
                     'plate': plate,
-                    'entry_time': info['entry_time'],
+                    'entry_time': entry_time_str,
                     'duration_hours': round(hours, 2),
-                    'payment_status': 'Paid' if info['payment_status'] == '1' else 'Pending',
+                    'payment_status': 'Paid' if payment_status == '1' else 'Pending',
                     'estimated_fee': round(hours * system_stats['hourly_rate'], 2)
                 })
     
     except Exception as e:
-        print(f"Error getting vehicles inside: {e}")
+        log.error("Error getting vehicles inside: %s", e)
     
     return jsonify(vehicles_inside)
 
@@ -341,15 +613,10 @@ def get_security_alerts():
     """Get security alerts from CSV"""
     alerts = []
     try:
-        if os.path.exists(SECURITY_LOG_FILE):
-            with open(SECURITY_LOG_FILE, 'r') as f:
-                reader = csv.DictReader(f)
-                alerts = [row for row in reader]
+        alerts = read_csv_rows(SECURITY_LOG_FILE)
     except FileNotFoundError:
         # Create empty security alerts file
-        with open(SECURITY_LOG_FILE, 'w', newline='') as f:
-            writer = csv.writer(f)
-            writer.writerow(['Timestamp', 'Plate Number', 'Alert Type', 'Status', 'Action Taken', 'Personnel Notified'])
+        get_log_writer(SECURITY_LOG_FILE)
     return jsonify(alerts)
 
 # Socket events
@@ -357,7 +624,7 @@ def get_security_alerts():
 def on_connect():
     update_system_stats()
     socketio.emit('stats_update', system_stats)
-    socketio.emit('activities_update', recent_activities)
+    socketio.emit('activities_update', list(recent_activities))
 
 @socketio.on('request_update')
 def handle_update_request():
@@ -368,48 +635,35 @@ def handle_update_request():
 def log_vehicle_exit(plate_number, entry_time_str, amount_paid=0):
     """Log vehicle exit - call this from car_exit.py"""
     try:
-        entry_time = datetime.strptime(entry_time_str, '%Y-%m-%d %H:%M:%S')
+        entry_time = parse_timestamp(entry_time_str)
         exit_time = datetime.now()
         duration = exit_time - entry_time
         duration_str = str(duration).split('.')[0]  # Remove microseconds
         
-        with open(EXIT_LOG, 'a', newline='') as f:
-            writer = csv.writer(f)
-            writer.writerow([
-                plate_number,
-                entry_time_str,
-                exit_time.strftime('%Y-%m-%d %H:%M:%S'),
-                duration_str,
-                amount_paid
-            ])
+        append_log_row(EXIT_LOG, [
+            plate_number,
+            entry_time_str,
+            exit_time.strftime('%Y-%m-%d %H:%M:%S'),
+            duration_str,
+            amount_paid
+        ])
         
         log_activity('EXIT', plate_number, f'Exited after {duration_str}', 'SUCCESS')
         
     except Exception as e:
-        print(f"Error logging exit: {e}")
+        log.error("Error logging exit: %s", e)
 
 if __name__ == '__main__':
     # Create necessary files
-    if not os.path.exists(CSV_FILE):
-        with open(CSV_FILE, 'w', newline='') as f:
-            writer = csv.writer(f)
-            writer.writerow(['Plate Number', 'Payment Status', 'Timestamp'])
-    
-    if not os.path.exists(PAYMENT_LOG):
-        open(PAYMENT_LOG, 'w').close()
-    
-    if not os.path.exists(SECURITY_LOG_FILE):
-        with open(SECURITY_LOG_FILE, 'w', newline='') as f:
-            writer = csv.writer(f)
-            writer.writerow(['Timestamp', 'Plate Number', 'Alert Type', 'Status', 'Action Taken', 'Personnel Notified'])
-    
-    create_exit_log_if_not_exists()
+    for path in (CSV_FILE, PAYMENT_LOG, SECURITY_LOG_FILE, EXIT_LOG):
+        get_log_writer(path)
     
-    # Start log watcher thread
-    Thread(target=watch_logs, daemon=True).start()
+    # Start log watcher and emitter as background tasks of the socketio server
+    socketio.start_background_task(watch_logs)
+    socketio.start_background_task(emit_batches)
     
     print("🚗 Smart Parking Management System Web Interface")
     print("🌐 Access dashboard at: http://localhost:5000")
     print("📊 Real-time monitoring: Entry | Payment | Exit | Security")
     
-    socketio.run(app, debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
+    socketio.run(app, debug=False, host='0.0.0.0', port=5000, use_reloader=False)
\ No newline at end of file
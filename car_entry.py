@@ -1,28 +1,114 @@
 import os
+import sys
 import time
+import select
 import glob
 import serial
 import serial.tools.list_ports
 import pytesseract
 import cv2
+import numpy as np
+import torch
 from ultralytics import YOLO
 import re
 import threading
-from collections import deque, Counter
+import queue
+import logging
+import logging.handlers
+import zlib
+from collections import deque, defaultdict
 from datetime import datetime
 import csv
 
+# Diagnostics go through a queue so formatting and stderr writes happen on a
+# background thread; LOG_LEVEL=DEBUG shows per-frame output such as sensor readings
+log = logging.getLogger('car_entry')
+log.setLevel(os.environ.get('LOG_LEVEL', 'WARNING').upper())
+log.propagate = False
+log_queue = queue.Queue(-1)
+log.addHandler(logging.handlers.QueueHandler(log_queue))
+_log_stream = logging.StreamHandler()
+_log_stream.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(message)s'))
+log_listener = logging.handlers.QueueListener(log_queue, _log_stream)
+log_listener.start()
+
 # Point pytesseract at the system binary on Linux
 pytesseract.pytesseract.tesseract_cmd = '/usr/bin/tesseract'
 
+try:
+    import re2 as plate_re
+except ImportError:
+    plate_re = re
+
+try:
+    from tesserocr import PyTessBaseAPI, PSM, OEM
+    from PIL import Image
+except ImportError:
+    PyTessBaseAPI = None
+
+PLATE_CHARS = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789'
+
+# Keep one Tesseract instance loaded in-process instead of spawning the CLI per crop
+if PyTessBaseAPI is not None:
+    ocr = PyTessBaseAPI(psm=PSM.SINGLE_WORD, oem=OEM.DEFAULT)
+    ocr.SetVariable('tessedit_char_whitelist', PLATE_CHARS)
+else:
+    ocr = None
+
 MODEL_PATH = os.path.expanduser("/home/viateur/Documents/parking-management-system/best.pt")
-model = YOLO(MODEL_PATH)
+MODEL_IMGSZ = 640
+DEVICE = 0 if torch.cuda.is_available() else 'cpu'
+USE_HALF = DEVICE != 'cpu'  # FP16 inference is only supported on CUDA
+
+def load_detector(pt_path):
+    """
+    Load the fastest available form of the plate detector.
+    Uses a TensorRT engine on CUDA or an ONNX model on CPU next to the .pt
+    file, exporting it once if missing. Falls back to the PyTorch weights.
+    """
+    export_format = 'engine' if DEVICE != 'cpu' else 'onnx'
+    exported_path = os.path.splitext(pt_path)[0] + '.' + export_format
+
+    if not os.path.exists(exported_path):
+        try:
+            log.warning("[MODEL] Exporting %s to %s (one-time)...", pt_path, export_format)
+            exported_path = YOLO(pt_path).export(format=export_format, half=USE_HALF,
+                                                 imgsz=MODEL_IMGSZ, device=DEVICE)
+        except Exception as e:
+            log.warning("[MODEL] Export failed (%s), using PyTorch weights", e)
+            detector = YOLO(pt_path)
+            detector.fuse()
+            return detector
+
+    log.info("[MODEL] Loaded %s", exported_path)
+    return YOLO(exported_path, task='detect')
+
+model = load_detector(MODEL_PATH)
+# Warm-up call so device placement and precision are settled before the first real frame
+model.predict(np.zeros((MODEL_IMGSZ, MODEL_IMGSZ, 3), np.uint8),
+              device=DEVICE, half=USE_HALF, imgsz=MODEL_IMGSZ, verbose=False)
+
+# No display server means no OpenCV windows; skip drawing entirely
+HEADLESS = sys.platform.startswith('linux') and not (
+    os.environ.get('DISPLAY') or os.environ.get('WAYLAND_DISPLAY'))
 
 # BUFFER & PLATE-FINDING SETUP
 BUFFER_SIZE = 3
 plate_buffer = deque(maxlen=BUFFER_SIZE)
-plate_pattern = re.compile(r'([A-Z]{3}\d{3}[A-Z])')
+plate_counts = defaultdict(int)  # readings per plate currently in plate_buffer
+# RE2 matches in linear time with no backtracking; fall back to the stdlib engine
+plate_pattern = plate_re.compile(r'([A-Z]{3}\d{3}[A-Z])')
 entry_cooldown = 300
+
+# Static-scene guard: a 32x32 grey thumbnail whose mean absolute difference from the
+# scene reference stays under MOTION_THRESHOLD counts as unchanged, and an unchanged
+# scene only gets enough detector passes for one plate vote. Passes are counted when the
+# detector takes a frame, since frames waiting in frame_slot can be replaced unseen
+MOTION_THRESHOLD = 2
+STATIC_FRAME_BUDGET = BUFFER_SIZE
+scene_id = 0        # Bumped by capture_loop whenever the scene changes
+scene_passes = 0    # Detector passes run on frames of the current scene
+scene_lock = threading.Lock()
 last_saved_plate = None
 last_entry_time = 0
 
@@ -33,6 +119,10 @@ if not os.path.exists(CSV_FILE):
         writer = csv.writer(f)
         writer.writerow(['Plate Number', 'Payment Status', 'Timestamp'])
 
+# Keep one line-buffered append handle open for the per-plate writes
+csv_log = open(CSV_FILE, 'a', newline='', buffering=1)
+csv_writer = csv.writer(csv_log)
+
 print("[SYSTEM] Ready. Press 'q' to exit.")
 
 # ===== Auto-detect Arduino Serial Port =====ca
@@ -47,115 +137,344 @@ def detect_arduino_port():
 
 arduino_port = detect_arduino_port()
 if arduino_port:
-    print(f"[CONNECTED] Arduino on {arduino_port}")
+    log.info("[CONNECTED] Arduino on %s", arduino_port)
     arduino = serial.Serial(arduino_port, 9600, timeout=1)
     time.sleep(2)
 else:
-    print("[ERROR] Arduino not detected.")
+    log.error("[ERROR] Arduino not detected.")
     arduino = None
 
 # ===== Read Distance from Arduino =====
+last_distance = None
+
 def read_distance():
     """
-    Reads a distance (float) value from the Arduino via serial.
-    Returns the float if valid, or None if invalid/empty.
+    Drains every queued distance line from the Arduino and returns the newest
+    valid reading (float). Returns the previous reading when nothing new has
+    arrived, or None before the first valid one.
     """
-    if arduino and arduino.in_waiting > 0:
+    global last_distance
+    if not arduino:
+        return None
+
+    # Cheap readiness check on the tty fd before touching pyserial
+    if os.name == 'posix':
+        ready, _, _ = select.select([arduino], [], [], 0)
+        if not ready:
+            return last_distance
+
+    while arduino.in_waiting > 0:
         try:
             line = arduino.readline().decode('utf-8').strip()
-            return float(line)
+            last_distance = float(line)
         except ValueError:
-            return None
-    return None
+            continue
+    return last_distance
+
+# ===== Plate OCR =====
+# Run the preprocessing chain through OpenCL (transparent API) when a device is available
+USE_OPENCL = cv2.ocl.haveOpenCL()
+cv2.ocl.setUseOpenCL(USE_OPENCL)
+
+def preprocess_plate(plate_img):
+    """
+    Grey -> blur -> Otsu binarisation of a plate crop.
+    The crop stays on the OpenCL device until the final threshold when available.
+    """
+    src = cv2.UMat(plate_img) if USE_OPENCL else plate_img
+    gray = cv2.cvtColor(src, cv2.COLOR_BGR2GRAY)
+    blur = cv2.GaussianBlur(gray, (5, 5), 0)
+    thresh = cv2.threshold(
+        blur, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU
+    )[1]
+    return thresh.get() if USE_OPENCL else thresh
+
+def read_plate_text(thresh):
+    """
+    OCR a binarised plate crop as a single word.
+    Uses the persistent tesserocr API when installed, pytesseract otherwise.
+    """
+    if ocr is not None:
+        ocr.SetImage(Image.fromarray(thresh))
+        text = ocr.GetUTF8Text()
+    else:
+        text = pytesseract.image_to_string(
+            thresh,
+            config=f'--psm 8 --oem 3 -c tessedit_char_whitelist={PLATE_CHARS}'
+        )
+    return text.strip().replace(" ", "")
+
+OCR_STACK_GAP = 10  # white rows between stacked crops in a batched pytesseract call
+
+def read_plate_texts(threshes):
+    """
+    OCR several binarised crops, paying the Tesseract startup cost once.
+    tesserocr reuses its loaded instance per crop; pytesseract gets a single
+    call on the crops stacked vertically, read back one line per crop.
+    """
+    if ocr is not None or len(threshes) < 2:
+        return [read_plate_text(thresh) for thresh in threshes]
+
+    width = max(thresh.shape[1] for thresh in threshes)
+    stacked = np.vstack([
+        cv2.copyMakeBorder(thresh, OCR_STACK_GAP, OCR_STACK_GAP, 0, width - thresh.shape[1],
+                           cv2.BORDER_CONSTANT, value=255)
+        for thresh in threshes
+    ])
+    text = pytesseract.image_to_string(
+        stacked,
+        config=f'--psm 6 --oem 3 -c tessedit_char_whitelist={PLATE_CHARS}'
+    )
+    lines = [line.strip().replace(" ", "") for line in text.splitlines() if line.strip()]
+
+    if len(lines) != len(threshes):
+        # Tesseract merged or dropped a line, so read the crops one at a time
+        return [read_plate_text(thresh) for thresh in threshes]
+    return lines
+
+# ===== Plate Vote =====
+def add_plate_reading(plate):
+    """Push a reading into the vote buffer, keeping plate_counts in step with evictions"""
+    if len(plate_buffer) == BUFFER_SIZE:
+        evicted = plate_buffer[0]
+        plate_counts[evicted] -= 1
+        if not plate_counts[evicted]:
+            del plate_counts[evicted]
+    plate_buffer.append(plate)
+    plate_counts[plate] += 1
+
+def take_plate_vote():
+    """Return the most frequent buffered reading and reset the vote"""
+    most_common = max(plate_counts, key=plate_counts.get)
+    plate_buffer.clear()
+    plate_counts.clear()
+    return most_common
 
 # ===== Open Gate Function =====
-def open_gate(arduino_conn, open_duration=15):
-    arduino_conn.write(b'1')
-    print("[GATE] Opening gate")
-    time.sleep(open_duration)
+gate_timer = None
+gate_lock = threading.Lock()
+
+def close_gate(arduino_conn):
     arduino_conn.write(b'0')
-    print("[GATE] Closing gate")
+    log.info("[GATE] Closing gate")
 
-# Initialize webcam
-cap = cv2.VideoCapture(0)
+def open_gate(arduino_conn, open_duration=15):
+    """
+    Open the gate and schedule it to close after open_duration seconds.
+    Opening again while it is still open restarts the countdown.
+    """
+    global gate_timer
+    with gate_lock:
+        if gate_timer:
+            gate_timer.cancel()
+        arduino_conn.write(b'1')
+        log.info("[GATE] Opening gate")
+        gate_timer = threading.Timer(open_duration, close_gate, args=(arduino_conn,))
+        gate_timer.daemon = True
+        gate_timer.start()
 
-while True:
-    ret, frame = cap.read()
-    if not ret:
-        break
+# ===== Pipeline Stages =====
+# Single-slot queues: each stage always picks up the newest item and stale ones are dropped
+frame_slot = queue.Queue(maxsize=1)    # capture -> detector
+crop_slot = queue.Queue(maxsize=1)     # detector -> OCR
+display_slot = queue.Queue(maxsize=1)  # capture/detector -> main thread
+preview_slot = queue.Queue(maxsize=1)  # OCR -> main thread
+stop_event = threading.Event()
 
-    distance = read_distance()
-    print(f"[SENSOR] Distance: {distance}")
+def put_latest(slot, item):
+    """Replace whatever is waiting in a single-slot queue with item"""
+    try:
+        slot.get_nowait()
+    except queue.Empty:
+        pass
+    try:
+        slot.put_nowait(item)
+    except queue.Full:
+        pass  # Another producer refilled the slot first
 
-    # 1) If we didn't get a valid distance, skip processing
-    if distance is None:
-        cv2.imshow('Webcam Feed', frame)
-        if cv2.waitKey(1) & 0xFF == ord('q'):
+def capture_loop():
+    """Read frames at camera rate and pass them on when a car is close and the scene changed"""
+    global scene_id, scene_passes
+    scene_ref = None
+
+    while not stop_event.is_set():
+        ret, frame = cap.read()
+        if not ret:
+            stop_event.set()
             break
-        continue
 
-    # 2) Only run the heavy YOLO + OCR pipeline if we're close enough
-    if distance <= 50:
-        results = model(frame)
+        distance = read_distance()
+        log.debug("[SENSOR] Distance: %s", distance)
+
+        # Only run the heavy YOLO + OCR pipeline on a fresh, close reading
+        if distance is not None and distance <= 50:
+            small = cv2.resize(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), (32, 32)).astype(np.int16)
+            if scene_ref is None or np.abs(small - scene_ref).mean() >= MOTION_THRESHOLD:
+                scene_ref = small
+                with scene_lock:
+                    scene_id += 1
+                    scene_passes = 0
+
+            if scene_passes < STATIC_FRAME_BUDGET:
+                put_latest(frame_slot, (scene_id, frame))
+                continue
+
+        if not HEADLESS:
+            put_latest(display_slot, frame)
+
+def detect_loop():
+    """Run YOLO on the newest close-range frame and hand plate crops to OCR"""
+    global scene_passes
+    while not stop_event.is_set():
+        try:
+            frame_scene, frame = frame_slot.get(timeout=0.5)
+        except queue.Empty:
+            continue
+
+        with scene_lock:
+            if frame_scene == scene_id:
+                scene_passes += 1
+
+        results = model.predict(frame, device=DEVICE, half=USE_HALF,
+                                imgsz=MODEL_IMGSZ, verbose=False)
+        crops = []
         for result in results:
             for box in result.boxes:
                 x1, y1, x2, y2 = map(int, box.xyxy[0])
-                plate_img = frame[y1:y2, x1:x2]
-
-                gray = cv2.cvtColor(plate_img, cv2.COLOR_BGR2GRAY)
-                blur = cv2.GaussianBlur(gray, (5, 5), 0)
-                thresh = cv2.threshold(
-                    blur, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU
-                )[1]
-
-                plate_text = pytesseract.image_to_string(
-                    thresh,
-                    config='--psm 8 --oem 3 '
-                           '-c tessedit_char_whitelist=ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789'
-                ).strip().replace(" ", "")
-
-                match = plate_pattern.search(plate_text)
-                if match:
-                    plate = match.group(1)
-                    print(f"[VALID] Plate Detected: {plate}")
-                    plate_buffer.append(plate)
-
-                    if len(plate_buffer) == BUFFER_SIZE:
-                        most_common, _ = Counter(plate_buffer).most_common(1)[0]
-                        plate_buffer.clear()
-                        now = time.time()
-
-                        if (most_common != last_saved_plate or
-                           (now - last_entry_time) > entry_cooldown):
-                            timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-
-                            # Log to CSV
-                            with open(CSV_FILE, 'a', newline='') as f:
-                                writer = csv.writer(f)
-                                writer.writerow([most_common, "0", timestamp])
-                            print(f"[SAVED] {most_common} logged to CSV.")
-
-                            if arduino:
-                                threading.Thread(target=open_gate, args=(arduino,)).start()
-
-                            last_saved_plate = most_common
-                            last_entry_time = now
-                        else:
-                            print(f"[SKIPPED] {most_common} skipped due to cooldown.")
-
-                cv2.imshow("Plate", plate_img)
-                cv2.imshow("Processed", thresh)
-                time.sleep(0.5)
-
-        annotated_frame = results[0].plot()
-    else:
-        annotated_frame = frame
+                crops.append(frame[y1:y2, x1:x2])
+
+        if crops:
+            put_latest(crop_slot, crops)
+        if not HEADLESS:
+            put_latest(display_slot, results[0].plot())
+
+def ocr_loop():
+    """Read plate text, vote over BUFFER_SIZE readings, then log the entry and open the gate"""
+    global last_saved_plate, last_entry_time
+    ocr_cache = {}  # crop key -> text, for the previous batch of crops
+
+    while not stop_event.is_set():
+        try:
+            crops = crop_slot.get(timeout=0.5)
+        except queue.Empty:
+            continue
+
+        plates = []
+        for plate_img in crops:
+            thresh = preprocess_plate(plate_img)
+
+            # Nearly all-black or all-white crops hold no readable characters
+            if 0.02 < thresh.mean() / 255 < 0.98:
+                plates.append((plate_img, thresh, (thresh.shape, zlib.crc32(thresh.tobytes()))))
+
+        # An identical binarised crop reads the same, so only new crops go to Tesseract
+        pending = [(thresh, key) for _, thresh, key in plates if key not in ocr_cache]
+        texts = read_plate_texts([thresh for thresh, _ in pending])
+        batch_cache = {key: ocr_cache[key] for _, _, key in plates if key in ocr_cache}
+        batch_cache.update(zip([key for _, key in pending], texts))
+        ocr_cache = batch_cache
+
+        for plate_img, thresh, key in plates:
+            plate_text = ocr_cache[key]
+
+            match = plate_pattern.search(plate_text)
+            if match:
+                plate = match.group(1)
+                log.info("[VALID] Plate Detected: %s", plate)
+                add_plate_reading(plate)
+
+                if len(plate_buffer) == BUFFER_SIZE:
+                    most_common = take_plate_vote()
+                    now = time.time()
+
+                    if (most_common != last_saved_plate or
+                       (now - last_entry_time) > entry_cooldown):
+                        timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+                        # Log to CSV
+                        csv_writer.writerow([most_common, "0", timestamp])
+                        log.info("[SAVED] %s logged to CSV.", most_common)
+
+                        if arduino:
+                            open_gate(arduino)
+
+                        last_saved_plate = most_common
+                        last_entry_time = now
+                    else:
+                        log.info("[SKIPPED] %s skipped due to cooldown.", most_common)
+
+            if not HEADLESS:
+                put_latest(preview_slot, (plate_img, thresh))
+
+# ===== Camera Setup =====
+CAMERA_WIDTH = 1280
+CAMERA_HEIGHT = 720
+# Optional GStreamer pipeline (e.g. Jetson/Pi zero-copy capture) used instead of device 0
+CAMERA_PIPELINE = os.environ.get('CAMERA_PIPELINE')
+
+def open_camera():
+    """
+    Open the entry camera with MJPEG frames and a one-frame driver buffer,
+    so every read() returns a fresh frame.
+    """
+    if CAMERA_PIPELINE:
+        return cv2.VideoCapture(CAMERA_PIPELINE, cv2.CAP_GSTREAMER)
+
+    backend = cv2.CAP_V4L2 if sys.platform.startswith('linux') else cv2.CAP_ANY
+    camera = cv2.VideoCapture(0, backend)
+    camera.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*'MJPG'))
+    camera.set(cv2.CAP_PROP_FRAME_WIDTH, CAMERA_WIDTH)
+    camera.set(cv2.CAP_PROP_FRAME_HEIGHT, CAMERA_HEIGHT)
+    camera.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+    return camera
+
+# Initialize webcam
+cap = open_camera()
+
+workers = [threading.Thread(target=stage, daemon=True)
+           for stage in (capture_loop, detect_loop, ocr_loop)]
+for worker in workers:
+    worker.start()
+
+if HEADLESS:
+    print("[SYSTEM] No display found, running headless. Press Ctrl+C to exit.")
+    try:
+        while not stop_event.wait(0.5):
+            pass
+    except KeyboardInterrupt:
+        pass
+else:
+    # The main thread only draws; OpenCV windows must be driven from here
+    while not stop_event.is_set():
+        try:
+            cv2.imshow('Webcam Feed', display_slot.get(timeout=0.1))
+        except queue.Empty:
+            pass
+
+        try:
+            plate_img, thresh = preview_slot.get_nowait()
+            cv2.imshow("Plate", plate_img)
+            cv2.imshow("Processed", thresh)
+        except queue.Empty:
+            pass
+
+        if cv2.waitKey(1) & 0xFF == ord('q'):
+            break
 
-    cv2.imshow('Webcam Feed', annotated_frame)
-    if cv2.waitKey(1) & 0xFF == ord('q'):
-        break
+stop_event.set()
+for worker in workers:
+    worker.join()
 
 cap.release()
+csv_log.close()
+if ocr is not None:
+    ocr.End()
 if arduino:
+    # Close a gate that is still waiting on its timer before releasing the port
+    if gate_timer and gate_timer.is_alive():
+        gate_timer.cancel()
+        close_gate(arduino)
     arduino.close()
-cv2.destroyAllWindows()
\ No newline at end of file
+if not HEADLESS:
+    cv2.destroyAllWindows()
+log_listener.stop()
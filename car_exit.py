@@ -1,27 +1,44 @@
 import os
+import sys
 import time
-import glob
-import serial
-import serial.tools.list_ports
-import pytesseract
-import cv2
-from ultralytics import YOLO
-import re
+import signal
 import threading
-from collections import deque, Counter
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import csv
-
-# Point pytesseract at the system binary on Linux
-pytesseract.pytesseract.tesseract_cmd = '/usr/bin/tesseract'
+import queue
+import logging
+import logging.handlers
+import cv2
+from exit_core import ArduinoLink, PlatePipeline, PaymentStore, initialize_camera
+
+# Diagnostics go through a queue so formatting and stderr writes happen on a
+# background thread; LOG_LEVEL=DEBUG adds per-plate reads, cooldown skips and camera probing
+log = logging.getLogger('car_exit')
+log.setLevel(os.environ.get('LOG_LEVEL', 'INFO').upper())
+log.propagate = False
+log_queue = queue.Queue(-1)
+log.addHandler(logging.handlers.QueueHandler(log_queue))
+_log_stream = logging.StreamHandler()
+_log_stream.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(message)s'))
+log_listener = logging.handlers.QueueListener(log_queue, _log_stream)
+log_listener.start()
 
 MODEL_PATH = os.path.expanduser("/home/viateur/Documents/parking-management-system/best.pt")
-model = YOLO(MODEL_PATH)
+
+# Preview windows: EXIT_UI=1/0 forces them on/off, otherwise they are shown only when a
+# display is available. Frames are shrunk to UI_SIZE before being pushed to the display
+_exit_ui = os.environ.get('EXIT_UI')
+if _exit_ui is not None:
+    SHOW_UI = _exit_ui == '1'
+else:
+    SHOW_UI = not sys.platform.startswith('linux') or bool(
+        os.environ.get('DISPLAY') or os.environ.get('WAYLAND_DISPLAY'))
+UI_SIZE = (320, 240)
 
 # BUFFER & PLATE-FINDING SETUP
 BUFFER_SIZE = 3
-plate_buffer = deque(maxlen=BUFFER_SIZE)
-plate_pattern = re.compile(r'([A-Z]{3}\d{3}[A-Z])')
+pipeline = PlatePipeline(MODEL_PATH, buffer_size=BUFFER_SIZE)
 exit_cooldown = 60  # Shorter cooldown for exit
 last_processed_plate = None
 last_exit_time = 0
@@ -29,82 +46,63 @@ last_exit_time = 0
 # CSV log files
 CSV_FILE = 'plates_log.csv'
 SECURITY_LOG_FILE = 'security_alerts.csv'
+EXIT_LOG_FILE = 'exit_log.csv'
 
 # Security Alert Configuration - REDUCED TO 5 SECONDS
 ALERT_DURATION = 5  # 5 seconds for ALL unauthorized exit attempts
 MAX_UNAUTHORIZED_ATTEMPTS = 3  # Max attempts before lockdown
 unauthorized_attempts = {}  # Track attempts per plate
 
-print("[EXIT SYSTEM] 🚨 Enhanced Security Mode - 5 Second Alerts. Press 'q' to exit.")
-
-# ===== Auto-detect Arduino Serial Port =====
-def detect_arduino_port():
-    for dev in glob.glob("/dev/ttyACM*") + glob.glob("/dev/ttyUSB*"):
-        return dev
-    for port in serial.tools.list_ports.comports():
-        desc = port.description.lower()
-        if 'arduino' in desc or 'usb-serial' in desc:
-            return port.device
-    return None
-
-arduino_port = detect_arduino_port()
-if arduino_port:
-    print(f"[CONNECTED] Arduino on {arduino_port}")
-    arduino = serial.Serial(arduino_port, 9600, timeout=1)
-    time.sleep(2)
-else:
-    print("[ERROR] Arduino not detected.")
-    arduino = None
-
-# ===== Initialize Security Log =====
-def initialize_security_log():
-    """Create security alerts log if it doesn't exist"""
-    if not os.path.exists(SECURITY_LOG_FILE):
-        with open(SECURITY_LOG_FILE, 'w', newline='') as f:
-            writer = csv.writer(f)
-            writer.writerow(['Timestamp', 'Plate Number', 'Alert Type', 'Status', 'Action Taken', 'Personnel Notified'])
-        print(f"[SECURITY] Created {SECURITY_LOG_FILE}")
-
-initialize_security_log()
-
-# ===== Read Distance from Arduino =====
-def read_distance():
+print("[EXIT SYSTEM] 🚨 Enhanced Security Mode - 5 Second Alerts. Press 'q' or Ctrl+C to exit.")
+
+# ===== Connect to Arduino =====
+arduino = ArduinoLink.connect()
+
+# ===== Initialize Security and Exit Logs =====
+def open_log_writer(path, header):
     """
-    Reads a distance (float) value from the Arduino via serial.
-    Returns the float if valid, or None if invalid/empty.
+    Open a CSV log for appending with line buffering, writing its header if
+    the file is new. Returns the file handle and its csv.writer.
     """
-    if arduino and arduino.in_waiting > 0:
-        try:
-            line = arduino.readline().decode('utf-8').strip()
-            return float(line)
-        except ValueError:
-            return None
-    return None
+    is_new = not os.path.exists(path)
+    f = open(path, 'a', newline='', buffering=1)
+    writer = csv.writer(f)
+    if is_new:
+        writer.writerow(header)
+        log.info("[LOG] Created %s", path)
+    return f, writer
+
+# Kept open for the life of the process; detection and alarm code both write rows
+security_log, security_writer = open_log_writer(
+    SECURITY_LOG_FILE,
+    ['Timestamp', 'Plate Number', 'Alert Type', 'Status', 'Action Taken', 'Personnel Notified'])
+exit_log, exit_writer = open_log_writer(
+    EXIT_LOG_FILE,
+    ['Plate Number', 'Entry Time', 'Exit Time', 'Duration', 'Amount Paid', 'Exit Type', 'Security Status'])
+log_files_lock = threading.Lock()
 
 # ===== Check Payment Status in CSV =====
+payments = PaymentStore(CSV_FILE)
+
 def is_payment_complete(plate_number):
     """
     Check if the plate has completed payment (Payment Status = '1')
     Returns True if payment is complete, False otherwise
     """
     if not os.path.exists(CSV_FILE):
-        print(f"[ERROR] CSV file {CSV_FILE} not found")
+        log.error("[ERROR] CSV file %s not found", CSV_FILE)
         return False
     
     try:
-        with open(CSV_FILE, 'r') as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                if (row['Plate Number'] == plate_number and 
-                    row['Payment Status'] == '1'):
-                    print(f"[PAYMENT VERIFIED] ✅ {plate_number} has paid")
-                    return True
+        if payments.is_paid(plate_number):
+            log.info("[PAYMENT VERIFIED] %s has paid", plate_number)
+            return True
         
-        print(f"[PAYMENT PENDING] ⚠️ {plate_number} has not paid or not found")
+        log.warning("[PAYMENT PENDING] %s has not paid or not found", plate_number)
         return False
         
     except Exception as e:
-        print(f"[ERROR] Failed to read CSV: {e}")
+        log.error("[ERROR] Failed to read CSV: %s", e)
         return False
 
 # ===== Security Alert Functions =====
@@ -112,82 +110,56 @@ def log_security_alert(plate_number, alert_type, status, action_taken):
     """Log security alerts to CSV"""
     try:
         timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        with open(SECURITY_LOG_FILE, 'a', newline='') as f:
-            writer = csv.writer(f)
-            writer.writerow([timestamp, plate_number, alert_type, status, action_taken, 'YES'])
-        print(f"[SECURITY LOG] 📝 {alert_type} alert logged for {plate_number}")
+        with log_files_lock:
+            security_writer.writerow([timestamp, plate_number, alert_type, status, action_taken, 'YES'])
+        log.info("[SECURITY LOG] %s alert logged for %s", alert_type, plate_number)
     except Exception as e:
-        print(f"[ERROR] Failed to log security alert: {e}")
+        log.error("[ERROR] Failed to log security alert: %s", e)
 
 def trigger_unauthorized_exit_alarm(plate_number, arduino_conn):
     """
     Trigger 5-second alarm for ALL unauthorized exit attempts
     """
     try:
-        print(f"[🚨 SECURITY ALERT] UNAUTHORIZED EXIT ATTEMPT: {plate_number}")
-        print(f"[🚨 ALERT] Sounding 5-second alarm...")
-        print(f"[📞 ALERT] Security personnel notification activated!")
-        
         # Track unauthorized attempts
         if plate_number not in unauthorized_attempts:
             unauthorized_attempts[plate_number] = 0
         unauthorized_attempts[plate_number] += 1
         
         attempt_count = unauthorized_attempts[plate_number]
-        print(f"[⚠️ WARNING] Attempt #{attempt_count} for {plate_number}")
         
         # Determine alert type based on attempts (but ALL get 5-second duration)
         if attempt_count >= MAX_UNAUTHORIZED_ATTEMPTS:
             alert_type = "CRITICAL_SECURITY_BREACH"
             action_taken = f"LOCKDOWN_INITIATED_AFTER_{attempt_count}_ATTEMPTS"
             arduino_signal = b'9'  # Critical alert signal
-            print(f"[🔒 LOCKDOWN] Critical security breach - {attempt_count} unauthorized attempts!")
         elif attempt_count >= 2:
             alert_type = "HIGH_PRIORITY_ALERT"
             action_taken = f"REPEATED_UNAUTHORIZED_ATTEMPT_{attempt_count}"
             arduino_signal = b'8'  # High priority alert signal
-            print(f"[⚡ HIGH ALERT] Repeated unauthorized attempt!")
         else:
             alert_type = "UNAUTHORIZED_EXIT_ATTEMPT"
             action_taken = "ALARM_ACTIVATED_GATE_BLOCKED"
             arduino_signal = b'2'  # Standard alert signal
-            print(f"[🚨 ALERT] First unauthorized attempt!")
         
         # Send alarm signal to Arduino
         arduino_conn.write(arduino_signal)
-        print(f"[🔊 ALARM] {alert_type} - 5 SECOND BUZZER ACTIVATED")
-        
-        # Display security message
-        print("=" * 60)
-        print("🚨 5-SECOND SECURITY ALERT ACTIVATED 🚨")
-        print(f"Vehicle: {plate_number}")
-        print(f"Alert Level: {alert_type}")
-        print(f"Attempt Count: #{attempt_count}")
-        print(f"Duration: 5 SECONDS (ALL ATTEMPTS)")
-        print(f"Status: PAYMENT REQUIRED - EXIT DENIED")
-        print(f"Action: SECURITY PERSONNEL NOTIFIED")
-        print("=" * 60)
+        log.warning("[SECURITY ALERT] plate=%s level=%s attempt=%d - %ds alarm, exit denied, personnel notified",
+                    plate_number, alert_type, attempt_count, ALERT_DURATION)
         
         # ALL alerts get exactly 5 seconds - no exceptions
-        print(f"[⏰ TIMER] 5-second alarm countdown:")
-        for remaining in range(5, 0, -1):
-            print(f"   🔊 {remaining} seconds remaining - BUZZER ACTIVE")
-            time.sleep(1)
-        
-        # Stop alarm after exactly 5 seconds
-        arduino_conn.write(b'0')
-        print(f"[🔕 ALARM] Security alarm deactivated after 5 seconds")
+        arduino_conn.schedule_write(ALERT_DURATION, b'0',
+                                    f"[ALARM] Security alarm deactivated after {ALERT_DURATION} seconds")
         
         # Log the security incident
         log_security_alert(plate_number, alert_type, "ACTIVE", action_taken)
         
         # Generate incident report for critical cases only
         if attempt_count >= MAX_UNAUTHORIZED_ATTEMPTS:
-            print(f"[📋 REPORT] Generating incident report for {plate_number}")
             generate_incident_report(plate_number, attempt_count)
         
     except Exception as e:
-        print(f"[ERROR] Security alarm failed: {e}")
+        log.error("[ERROR] Security alarm failed: %s", e)
 
 def generate_incident_report(plate_number, attempts):
     """Generate detailed incident report for security review"""
@@ -214,56 +186,32 @@ def generate_incident_report(plate_number, attempts):
             f.write("4. Consider penalties for repeated violations\n")
             f.write("=" * 50 + "\n")
         
-        print(f"[📄 REPORT] Incident report saved: {report_file}")
+        log.info("[REPORT] Incident report saved: %s", report_file)
         
     except Exception as e:
-        print(f"[ERROR] Failed to generate incident report: {e}")
+        log.error("[ERROR] Failed to generate incident report: %s", e)
 
 def reset_unauthorized_attempts(plate_number):
     """Reset unauthorized attempts counter after successful payment"""
     if plate_number in unauthorized_attempts:
         del unauthorized_attempts[plate_number]
-        print(f"[✅ CLEARED] Unauthorized attempts reset for {plate_number}")
+        log.info("[CLEARED] Unauthorized attempts reset for %s", plate_number)
 
 # ===== Enhanced Gate Control =====
 def open_gate(arduino_conn, open_duration=10):
-    """Open the exit gate for paid vehicles"""
+    """Open the exit gate for paid vehicles and schedule it to close after open_duration seconds"""
     try:
-        arduino_conn.write(b'1')
-        print("[GATE] ✅ Opening exit gate for authorized vehicle")
-        time.sleep(open_duration)
-        arduino_conn.write(b'0')
-        print("[GATE] 🔒 Closing exit gate")
+        arduino_conn.open_gate(open_duration)
+        log.info("[GATE] Opening exit gate for authorized vehicle")
     except Exception as e:
-        print(f"[ERROR] Gate control failed: {e}")
+        log.error("[ERROR] Gate control failed: %s", e)
 
 def trigger_alert(arduino_conn):
     """Legacy function - redirects to unauthorized exit alarm"""
-    print("[LEGACY] Redirecting to unauthorized exit alarm...")
+    log.debug("[LEGACY] Redirecting to unauthorized exit alarm...")
     # Use a placeholder plate for legacy calls
     trigger_unauthorized_exit_alarm("UNKNOWN", arduino_conn)
 
-# ===== Camera Initialization with Fallback =====
-def initialize_camera():
-    """Try to find and initialize a working camera"""
-    print("[CAMERA] Initializing exit camera...")
-    
-    for camera_index in range(3):  # Try indices 0-2
-        print(f"[CAMERA] Trying camera index {camera_index}...")
-        cap = cv2.VideoCapture(camera_index)
-        
-        if cap.isOpened():
-            ret, test_frame = cap.read()
-            if ret:
-                print(f"[CAMERA] ✅ Exit camera connected at index {camera_index}")
-                return cap, camera_index
-            else:
-                cap.release()
-        print(f"[CAMERA] ❌ Camera {camera_index} failed")
-    
-    print("[CAMERA] ❌ No working cameras found for exit")
-    return None, -1
-
 # ===== Enhanced Exit Logging =====
 def log_exit_to_csv(plate_number, exit_type="AUTHORIZED"):
     """Log vehicle exit to exit_log.csv with security status"""
@@ -272,12 +220,7 @@ def log_exit_to_csv(plate_number, exit_type="AUTHORIZED"):
         entry_time = None
         amount_paid = 0
         
-        with open('plates_log.csv', 'r') as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                if row['Plate Number'] == plate_number:
-                    entry_time = row['Timestamp']
-                    break
+        entry_time = payments.entry_time(plate_number)
         
         if entry_time:
             exit_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
@@ -291,34 +234,116 @@ def log_exit_to_csv(plate_number, exit_type="AUTHORIZED"):
                 hours = (exit_dt - entry_dt).total_seconds() / 3600
                 amount_paid = max(500, int(hours * 500))  # 500 RWF per hour, minimum 500
                 
-            # Create exit log with headers if it doesn't exist
-            if not os.path.exists('exit_log.csv'):
-                with open('exit_log.csv', 'w', newline='') as f:
-                    writer = csv.writer(f)
-                    writer.writerow(['Plate Number', 'Entry Time', 'Exit Time', 'Duration', 'Amount Paid', 'Exit Type', 'Security Status'])
-            
-            with open('exit_log.csv', 'a', newline='') as f:
-                writer = csv.writer(f)
-                writer.writerow([plate_number, entry_time, exit_time, duration, amount_paid, exit_type, 
-                               "CLEARED" if exit_type == "AUTHORIZED" else "FLAGGED"])
+            with log_files_lock:
+                exit_writer.writerow([plate_number, entry_time, exit_time, duration, amount_paid, exit_type, 
+                                      "CLEARED" if exit_type == "AUTHORIZED" else "FLAGGED"])
                 
-            print(f"[EXIT LOGGED] 📝 {plate_number} logged as {exit_type} exit")
+            log.info("[EXIT LOGGED] %s logged as %s exit", plate_number, exit_type)
             
         else:
-            print(f"[WARNING] No entry record found for {plate_number}")
+            log.warning("[WARNING] No entry record found for %s", plate_number)
             
     except Exception as e:
-        print(f"[ERROR] Failed to log exit: {e}")
+        log.error("[ERROR] Failed to log exit: %s", e)
+
+# ===== Detection Worker =====
+latest_frame = None
+frame_lock = threading.Lock()
+capture_running = threading.Event()
+
+def capture_frames():
+    """Keep latest_frame pointing at the newest camera frame"""
+    global latest_frame
+    while capture_running.is_set():
+        ret, frame = cap.read()
+        if not ret:
+            log.error("[ERROR] Failed to read from camera")
+            capture_running.clear()
+            break
+        with frame_lock:
+            latest_frame = frame
+
+def handle_confirmed_plate(plate):
+    """Grant or deny exit for a plate confirmed by the vote, at most once per cooldown"""
+    global last_processed_plate, last_exit_time
+    now = time.time()
+
+    # Prevent duplicate processing
+    if plate == last_processed_plate and (now - last_exit_time) <= exit_cooldown:
+        log.debug("[SKIPPED] %s - Recent exit attempt", plate)
+        return
+
+    # Check payment status
+    if is_payment_complete(plate):
+        log.info("[ACCESS GRANTED] %s - Payment verified", plate)
+        if arduino:
+            open_gate(arduino)
+        
+        # Reset unauthorized attempts on successful payment
+        reset_unauthorized_attempts(plate)
+        
+        # Log successful exit
+        timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        log.info("[EXIT LOGGED] %s exited at %s", plate, timestamp)
+        log_exit_to_csv(plate, "AUTHORIZED")
+        
+    else:
+        log.warning("[ACCESS DENIED] %s - UNAUTHORIZED EXIT ATTEMPT", plate)
+        if arduino:
+            # Trigger 5-second security alarm; the stop is scheduled, not slept on
+            trigger_unauthorized_exit_alarm(plate, arduino)
+        
+        # Log unauthorized attempt
+        log_exit_to_csv(plate, "UNAUTHORIZED")
+
+    last_processed_plate = plate
+    last_exit_time = now
+
+def process_frame(frame):
+    """
+    Run YOLO + OCR on one close-range frame and act on a confirmed plate.
+    Returns the annotated frame and (plate crop, threshold) previews for display.
+    """
+    annotated_frame, readings = pipeline.detect(frame)
+    previews = []
+    for plate, plate_img, thresh in readings:
+        if plate:
+            log.debug("[DETECTED] Exit plate: %s", plate)
+            confirmed = pipeline.vote(plate)
+            if confirmed:
+                handle_confirmed_plate(confirmed)
+        previews.append((plate_img, thresh))
+    return annotated_frame, previews
 
 # Initialize webcam
 cap, camera_index = initialize_camera()
 
 if cap is None:
-    print("[EXIT SYSTEM] Running without camera - using simulation mode")
+    log.info("[EXIT SYSTEM] Running without camera - using simulation mode")
     simulation_mode = True
 else:
     simulation_mode = False
 
+# Detection runs on a single worker so the UI loop never waits on YOLO/OCR
+detector = ThreadPoolExecutor(max_workers=1)
+pending_detection = None
+annotated_frame = None
+vehicle_close = False
+capture_thread = None
+stop_requested = threading.Event()
+
+def request_stop(signum, frame):
+    """SIGINT handler: let the camera loop finish its iteration and shut down cleanly"""
+    stop_requested.set()
+
+if not simulation_mode:
+    # Ctrl+C is the exit path when there is no window to press 'q' in; simulation mode
+    # keeps the default handler so it can interrupt input()
+    signal.signal(signal.SIGINT, request_stop)
+    capture_running.set()
+    capture_thread = threading.Thread(target=capture_frames, daemon=True)
+    capture_thread.start()
+
 # Main loop
 while True:
     if simulation_mode:
@@ -342,9 +367,9 @@ while True:
         for plate in test_plates:
             print(f"\n[SIMULATED] Testing plate: {plate}")
             if is_payment_complete(plate):
-                print(f"[ACCESS GRANTED] ✅ {plate} - Payment verified, opening gate")
+                log.info("[ACCESS GRANTED] %s - Payment verified, opening gate", plate)
                 if arduino:
-                    threading.Thread(target=open_gate, args=(arduino,)).start()
+                    open_gate(arduino)
                 
                 # Reset unauthorized attempts on successful payment
                 reset_unauthorized_attempts(plate)
@@ -353,13 +378,13 @@ while True:
                 log_exit_to_csv(plate, "AUTHORIZED")
                 
             else:
-                print(f"[ACCESS DENIED] ❌ {plate} - UNAUTHORIZED EXIT ATTEMPT")
+                log.warning("[ACCESS DENIED] %s - UNAUTHORIZED EXIT ATTEMPT", plate)
                 if arduino:
-                    # Trigger 5-second security alarm in separate thread
-                    threading.Thread(target=trigger_unauthorized_exit_alarm, args=(plate, arduino)).start()
+                    # Trigger 5-second security alarm; the stop is scheduled, not slept on
+                    trigger_unauthorized_exit_alarm(plate, arduino)
                 else:
                     # Simulate 5-second alarm for testing without Arduino
-                    print(f"[🚨 SIMULATED ALARM] 5-second security alert for {plate}")
+                    log.warning("[SIMULATED ALARM] 5-second security alert for %s", plate)
                     log_security_alert(plate, "UNAUTHORIZED_EXIT_ATTEMPT", "SIMULATED", "5_SECOND_ALARM_ACTIVATED")
                 
                 # Log unauthorized attempt
@@ -368,103 +393,62 @@ while True:
             time.sleep(2)
         continue
     
-    # Camera mode
-    ret, frame = cap.read()
-    if not ret:
-        print("[ERROR] Failed to read from camera")
+    # Camera mode: frames come from the capture thread, detection runs on the worker
+    if stop_requested.is_set() or not capture_running.is_set():
         break
+    with frame_lock:
+        frame = latest_frame
+    if frame is None:
+        time.sleep(0.01)
+        continue
 
-    distance = read_distance()
+    distance = arduino.read_distance() if arduino else None
+    if distance is not None:
+        vehicle_close = distance <= 50
 
-    # Skip processing if no valid distance
-    if distance is None:
-        cv2.imshow('Exit Webcam Feed', frame)
-        if cv2.waitKey(1) & 0xFF == ord('q'):
-            break
+    # Collect a finished detection
+    if pending_detection is not None and pending_detection.done():
+        try:
+            annotated_frame, previews = pending_detection.result()
+            if SHOW_UI:
+                for plate_img, thresh in previews:
+                    cv2.imshow("Exit Plate", plate_img)
+                    cv2.imshow("Processed Plate", thresh)
+        except Exception as e:
+            log.error("[ERROR] Detection failed: %s", e)
+        pending_detection = None
+
+    # Process only a fresh, close reading of a changed scene, and only one frame at a time
+    if (distance is not None and distance <= 50 and pending_detection is None
+            and pipeline.scene_changed(frame)):
+        pending_detection = detector.submit(process_frame, frame)
+
+    if not SHOW_UI:
+        stop_requested.wait(0.01)
         continue
 
-    # Process only when vehicle is close
-    if distance <= 50:
-        results = model(frame)
-        for result in results:
-            for box in result.boxes:
-                x1, y1, x2, y2 = map(int, box.xyxy[0])
-                plate_img = frame[y1:y2, x1:x2]
-
-                # Image preprocessing
-                gray = cv2.cvtColor(plate_img, cv2.COLOR_BGR2GRAY)
-                blur = cv2.GaussianBlur(gray, (5, 5), 0)
-                thresh = cv2.threshold(
-                    blur, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU
-                )[1]
-
-                # OCR
-                plate_text = pytesseract.image_to_string(
-                    thresh,
-                    config='--psm 8 --oem 3 '
-                           '-c tessedit_char_whitelist=ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789'
-                ).strip().replace(" ", "")
-
-                match = plate_pattern.search(plate_text)
-                if match:
-                    plate = match.group(1)
-                    print(f"[DETECTED] Exit plate: {plate}")
-                    plate_buffer.append(plate)
-
-                    if len(plate_buffer) == BUFFER_SIZE:
-                        most_common, _ = Counter(plate_buffer).most_common(1)[0]
-                        plate_buffer.clear()
-                        now = time.time()
-
-                        # Prevent duplicate processing
-                        if (most_common != last_processed_plate or
-                           (now - last_exit_time) > exit_cooldown):
-                            
-                            # Check payment status
-                            if is_payment_complete(most_common):
-                                print(f"[ACCESS GRANTED] ✅ {most_common} - Payment verified")
-                                if arduino:
-                                    threading.Thread(target=open_gate, args=(arduino,)).start()
-                                
-                                # Reset unauthorized attempts on successful payment
-                                reset_unauthorized_attempts(most_common)
-                                
-                                # Log successful exit
-                                timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                                print(f"[EXIT LOGGED] ✅ {most_common} exited at {timestamp}")
-                                log_exit_to_csv(most_common, "AUTHORIZED")
-                                
-                            else:
-                                print(f"[ACCESS DENIED] ❌ {most_common} - UNAUTHORIZED EXIT ATTEMPT")
-                                if arduino:
-                                    # Trigger 5-second security alarm in separate thread
-                                    threading.Thread(target=trigger_unauthorized_exit_alarm, args=(most_common, arduino)).start()
-                                
-                                # Log unauthorized attempt
-                                log_exit_to_csv(most_common, "UNAUTHORIZED")
-
-                            last_processed_plate = most_common
-                            last_exit_time = now
-                        else:
-                            print(f"[SKIPPED] {most_common} - Recent exit attempt")
-
-                cv2.imshow("Exit Plate", plate_img)
-                cv2.imshow("Processed Plate", thresh)
-
-        annotated_frame = results[0].plot() if results else frame
-    else:
-        annotated_frame = frame
-
-    cv2.imshow('Exit Webcam Feed', annotated_frame)
+    # Show the latest detection while a vehicle is at the gate, the live feed otherwise
+    shown = annotated_frame if vehicle_close and annotated_frame is not None else frame
+    cv2.imshow('Exit Webcam Feed', cv2.resize(shown, UI_SIZE, interpolation=cv2.INTER_AREA))
     if cv2.waitKey(1) & 0xFF == ord('q'):
         break
 
+capture_running.clear()
+if capture_thread:
+    capture_thread.join()
+detector.shutdown(wait=True)
+
 # Cleanup
 if cap:
     cap.release()
+pipeline.close()
 if arduino:
     arduino.close()
-cv2.destroyAllWindows()
+if SHOW_UI:
+    cv2.destroyAllWindows()
+security_log.close()
+exit_log.close()
+log_listener.stop()
 
 # Display final security summary
 print("\n" + "=" * 60)
@@ -478,4 +462,4 @@ else:
     print("✅ NO UNAUTHORIZED EXIT ATTEMPTS DETECTED")
 
 print(f"📄 Security logs saved to: {SECURITY_LOG_FILE}")
-print("[EXIT SYSTEM] 🔒 Shutdown complete")
\ No newline at end of file
+print("[EXIT SYSTEM] 🔒 Shutdown complete")
@@ -0,0 +1,30 @@
+import os
+
+# CPU pinning shared by the exit gate (EXIT_CPUS) and payment (PAYMENT_CPUS) processes,
+# so both settings accept the same CPU list syntax
+
+def parse_cpu_list(spec):
+    """
+    Parse a CPU list such as '0-3,6' into a set of CPU ids.
+    Empty parts and surrounding whitespace are ignored; anything else that is not
+    a CPU id or a first-last range raises ValueError.
+    """
+    cpus = set()
+    for part in spec.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        first, _, last = part.partition('-')
+        cpus.update(range(int(first), int(last or first) + 1))
+    return cpus
+
+def pin_to_cpus(spec):
+    """
+    Pin the current process to the CPUs in spec that it is already allowed to run on.
+    Returns the CPUs pinned to; an empty set means none were usable and affinity is
+    unchanged. Raises ValueError for a malformed spec and OSError if pinning fails.
+    """
+    cpus = parse_cpu_list(spec) & os.sched_getaffinity(0)
+    if cpus:
+        os.sched_setaffinity(0, cpus)
+    return cpus
@@ -0,0 +1,493 @@
+import os
+import sys
+# Tesseract's OpenMP threading costs more than it saves on small plate crops;
+# the limit has to be in the environment before Tesseract is loaded
+os.environ.setdefault('OMP_THREAD_LIMIT', '1')
+import time
+import sched
+import shutil
+import tempfile
+import glob
+import re
+import threading
+import logging
+from collections import deque, Counter
+import serial
+import serial.tools.list_ports
+import pytesseract
+import cv2
+import numpy as np
+import torch
+from ultralytics import YOLO
+from cpu_affinity import pin_to_cpus
+
+# Shared by the exit gate entrypoints: Arduino link, plate detection/OCR pipeline and
+# payment lookups. Records go to the entrypoint's 'car_exit' logger handlers
+log = logging.getLogger('car_exit.core')
+
+# Point pytesseract at the system binary on Linux
+pytesseract.pytesseract.tesseract_cmd = '/usr/bin/tesseract'
+
+try:
+    from tesserocr import PyTessBaseAPI, PSM, OEM
+    from PIL import Image
+except ImportError:
+    PyTessBaseAPI = None
+
+try:
+    from numba import njit
+except ImportError:
+    def njit(*args, **kwargs):
+        """Stand-in for numba.njit when numba is not installed: run the function as plain Python"""
+        if len(args) == 1 and callable(args[0]) and not kwargs:
+            return args[0]
+        return lambda func: func
+
+PLATE_CHARS = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789'
+
+# Use the tessdata_fast LSTM model when it is installed, otherwise the default tessdata
+TESSDATA_FAST_DIR = os.environ.get('TESSDATA_FAST_DIR', '/usr/share/tesseract-ocr/tessdata_fast')
+TESSDATA_DIR = TESSDATA_FAST_DIR if os.path.exists(os.path.join(TESSDATA_FAST_DIR, 'eng.traineddata')) else None
+TESS_CONFIG = f'--psm 8 --oem 1 -c tessedit_char_whitelist={PLATE_CHARS}'
+if TESSDATA_DIR:
+    TESS_CONFIG += f' --tessdata-dir {TESSDATA_DIR}'
+OCR_WHITESPACE = b' \t\r\n\x0c'
+
+# Keep torch and OpenCV from each spawning a thread per core and fighting Tesseract and the
+# capture thread; EXIT_CPUS (e.g. "0-3" or "0,2") optionally pins the process to those cores
+TORCH_THREADS = int(os.environ.get('EXIT_TORCH_THREADS', '2'))
+torch.set_num_threads(TORCH_THREADS)
+torch.set_num_interop_threads(1)
+cv2.setNumThreads(1)
+
+EXIT_CPUS = os.environ.get('EXIT_CPUS')
+if EXIT_CPUS and hasattr(os, 'sched_setaffinity'):
+    try:
+        if not pin_to_cpus(EXIT_CPUS):
+            log.warning("[SYSTEM] EXIT_CPUS=%s names no usable CPU, affinity unchanged", EXIT_CPUS)
+    except (ValueError, OSError) as e:
+        log.warning("[SYSTEM] Could not pin to CPUs %s: %s", EXIT_CPUS, e)
+
+MODEL_IMGSZ = 320  # Matches the plate ROI below rather than the full frame
+DEVICE = 0 if torch.cuda.is_available() else 'cpu'
+USE_HALF = DEVICE != 'cpu'  # FP16 inference is only supported on CUDA
+
+# Capture at 640x480; with the camera fixed at the barrier a close plate sits in this
+# centre/lower region, and only that is sent to the detector
+FRAME_WIDTH, FRAME_HEIGHT = 640, 480
+ROI_Y0, ROI_Y1, ROI_X0, ROI_X1 = 120, 440, 80, 560
+
+# Adaptive threshold applied to each blurred plate crop
+THRESH_BLOCK_SIZE = 31
+THRESH_C = 2
+
+# Motion gate: an 80x60 grey thumbnail with fewer than MOTION_PIXELS pixels differing
+# by more than MOTION_DIFF from the last detected scene counts as unchanged
+MOTION_DIFF = 25
+MOTION_PIXELS = 50
+
+# ===== Auto-detect Arduino Serial Port =====
+def detect_arduino_port():
+    for dev in glob.glob("/dev/ttyACM*") + glob.glob("/dev/ttyUSB*"):
+        return dev
+    for port in serial.tools.list_ports.comports():
+        desc = port.description.lower()
+        if 'arduino' in desc or 'usb-serial' in desc:
+            return port.device
+    return None
+
+class ArduinoLink:
+    """
+    Serial link to the exit gate Arduino: batched distance reads, immediate
+    command writes, and deferred writes (gate close, alarm stop) served by one
+    scheduler thread instead of a sleeping thread per event.
+    """
+
+    def __init__(self, port, baudrate=9600):
+        self.serial = serial.Serial(port, baudrate, timeout=0.01)
+        time.sleep(2)
+        self._buffer = bytearray()
+        self._gate_close_event = None
+        # Entering an event wakes the scheduler so it never oversleeps a new deadline
+        self._wake = threading.Event()
+        self._scheduler = sched.scheduler(time.monotonic, self._wait)
+        threading.Thread(target=self._run_scheduler, daemon=True).start()
+
+    @classmethod
+    def connect(cls):
+        """Open the first Arduino found; returns None if none is attached"""
+        port = detect_arduino_port()
+        if not port:
+            log.error("[ERROR] Arduino not detected.")
+            return None
+        log.info("[CONNECTED] Arduino on %s", port)
+        return cls(port)
+
+    def read_distance(self):
+        """
+        Drains everything queued on the serial port in one read and returns the
+        newest complete distance line as a float.
+        Returns None if no new valid reading has arrived.
+        """
+        n = self.serial.in_waiting
+        if not n:
+            return None
+
+        self._buffer.extend(self.serial.read(n))
+        end = self._buffer.rfind(b'\n')
+        if end < 0:
+            return None  # Only a partial line so far
+        lines = self._buffer[:end].split(b'\n')
+        del self._buffer[:end + 1]  # Keep the trailing partial line for next time
+
+        for line in reversed(lines):
+            try:
+                return float(line)
+            except ValueError:
+                continue  # Blank line or a status message such as READY
+        return None
+
+    def write(self, data):
+        self.serial.write(data)
+
+    # ===== Deferred Writes =====
+    def _wait(self, timeout):
+        self._wake.wait(timeout)
+        self._wake.clear()
+
+    def _run_scheduler(self):
+        while True:
+            self._scheduler.run()
+            self._wake.wait()
+            self._wake.clear()
+
+    def _deferred_write(self, data, message):
+        try:
+            self.serial.write(data)
+            log.info(message)
+        except Exception as e:
+            log.error("[ERROR] Deferred Arduino write failed: %s", e)
+
+    def schedule_write(self, delay, data, message):
+        """Write data after delay seconds; returns the event for cancel_write()"""
+        event = self._scheduler.enter(delay, 1, self._deferred_write, (data, message))
+        self._wake.set()
+        return event
+
+    def cancel_write(self, event):
+        """Cancel a scheduled write if it has not run yet"""
+        try:
+            self._scheduler.cancel(event)
+        except ValueError:
+            pass  # Already ran
+
+    def open_gate(self, open_duration):
+        """Open the gate now and schedule it to close after open_duration seconds"""
+        self.write(b'1')
+        # A new car restarts the open period rather than stacking a second close
+        if self._gate_close_event is not None:
+            self.cancel_write(self._gate_close_event)
+        self._gate_close_event = self.schedule_write(open_duration, b'0', "[GATE] Closing exit gate")
+
+    def close(self):
+        """Send any pending close/stop immediately, then close the port"""
+        if not self._scheduler.empty():
+            for event in self._scheduler.queue:
+                self.cancel_write(event)
+            self.serial.write(b'0')
+        self.serial.close()
+
+# ===== Camera Initialization with Fallback =====
+def initialize_camera():
+    """
+    Try to find and initialize a working camera.
+    Requests MJPEG frames at 30 fps with a one-frame driver buffer, so every
+    read() returns a fresh frame.
+    """
+    log.info("[CAMERA] Initializing exit camera...")
+    backend = cv2.CAP_V4L2 if sys.platform.startswith('linux') else cv2.CAP_ANY
+
+    for camera_index in range(3):  # Try indices 0-2
+        log.debug("[CAMERA] Trying camera index %s...", camera_index)
+        cap = cv2.VideoCapture(camera_index, backend)
+
+        if cap.isOpened():
+            cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*'MJPG'))
+            cap.set(cv2.CAP_PROP_FRAME_WIDTH, FRAME_WIDTH)
+            cap.set(cv2.CAP_PROP_FRAME_HEIGHT, FRAME_HEIGHT)
+            cap.set(cv2.CAP_PROP_FPS, 30)
+            cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+            ret, test_frame = cap.read()
+            if ret:
+                log.info("[CAMERA] Exit camera connected at index %s", camera_index)
+                return cap, camera_index
+            else:
+                cap.release()
+        log.debug("[CAMERA] Camera %s failed", camera_index)
+
+    log.error("[CAMERA] No working cameras found for exit")
+    return None, -1
+
+# ===== Plate Detection and OCR =====
+def load_detector(pt_path):
+    """
+    Load the fastest available form of the plate detector.
+    Uses a TensorRT engine on CUDA or an ONNX Runtime model on CPU next to the
+    .pt file, exporting it once per input size if missing. Falls back to the PyTorch weights.
+    """
+    export_format = 'engine' if DEVICE != 'cpu' else 'onnx'
+    exported_path = f"{os.path.splitext(pt_path)[0]}-{MODEL_IMGSZ}.{export_format}"
+
+    if not os.path.exists(exported_path):
+        try:
+            log.info("[MODEL] Exporting %s to %s (one-time)...", pt_path, export_format)
+            # Exports have a fixed input size, so keep one file per MODEL_IMGSZ. Export from a
+            # copy in a scratch directory so car_entry.py's own export next to the weights
+            # (same basename, different size) is never overwritten or renamed away
+            with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(pt_path))) as tmp:
+                tmp_pt = shutil.copy(pt_path, tmp)
+                shutil.move(YOLO(tmp_pt).export(format=export_format, half=USE_HALF,
+                                                imgsz=MODEL_IMGSZ, device=DEVICE), exported_path)
+        except Exception as e:
+            log.warning("[MODEL] Export failed (%s), using PyTorch weights", e)
+            detector = YOLO(pt_path)
+            detector.fuse()
+            return detector
+
+    log.info("[MODEL] Loaded %s", exported_path)
+    return YOLO(exported_path, task='detect')
+
+@njit(cache=True)
+def extract_crops(boxes, height, width):
+    """
+    Convert float xyxy boxes to integer crop coordinates clipped to a height x width
+    image, dropping boxes that end up empty. Returns an (n, 4) int32 array.
+    """
+    out = np.empty((boxes.shape[0], 4), np.int32)
+    n = 0
+    for i in range(boxes.shape[0]):
+        x1 = min(max(int(boxes[i, 0]), 0), width)
+        y1 = min(max(int(boxes[i, 1]), 0), height)
+        x2 = min(max(int(boxes[i, 2]), 0), width)
+        y2 = min(max(int(boxes[i, 3]), 0), height)
+        if x2 > x1 and y2 > y1:
+            out[n, 0] = x1
+            out[n, 1] = y1
+            out[n, 2] = x2
+            out[n, 3] = y2
+            n += 1
+    return out[:n]
+
+class PlatePipeline:
+    """
+    Motion gate, YOLO plate detection on the barrier ROI, OCR and the plate
+    majority vote. Not thread-safe: run detect() from a single worker.
+    """
+    plate_pattern = re.compile(rb'([A-Z]{3}\d{3}[A-Z])')
+
+    def __init__(self, model_path, buffer_size=3):
+        self.model = load_detector(model_path)
+        self.buffer_size = buffer_size
+        self.plate_buffer = deque(maxlen=buffer_size)
+
+        # Keep one Tesseract instance loaded in-process instead of spawning the CLI per crop
+        if PyTessBaseAPI is not None:
+            tess_kwargs = {'path': TESSDATA_DIR} if TESSDATA_DIR else {}
+            self.ocr = PyTessBaseAPI(psm=PSM.SINGLE_WORD, oem=OEM.LSTM_ONLY, **tess_kwargs)
+            self.ocr.SetVariable('tessedit_char_whitelist', PLATE_CHARS)
+        else:
+            self.ocr = None
+
+        # Grey and blurred copies of the ROI, computed once per frame and sliced per box.
+        # They are passed back as dst= so OpenCV reuses them while the ROI shape stays the same
+        self.roi_gray = None
+        self.roi_blur = None
+        # Threshold scratch buffer reused across crops; grown when a larger crop arrives
+        self.thresh_buf = np.empty((240, 640), np.uint8)
+
+        # An unchanged scene only gets enough detector passes for one plate vote
+        self.static_frame_budget = buffer_size
+        self.scene_ref = None
+        self.static_hits = 0
+
+    def scene_changed(self, frame):
+        """Return True if the frame is worth a detector pass under the motion gate"""
+        small = cv2.resize(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), (80, 60),
+                           interpolation=cv2.INTER_AREA)
+        if self.scene_ref is None or cv2.countNonZero(
+                cv2.threshold(cv2.absdiff(small, self.scene_ref), MOTION_DIFF, 1, cv2.THRESH_BINARY)[1]) >= MOTION_PIXELS:
+            self.scene_ref = small
+            self.static_hits = 0
+            return True
+        self.static_hits += 1
+        return self.static_hits < self.static_frame_budget
+
+    def preprocess_roi(self, roi):
+        """Grey and blur the whole ROI once; returns the blurred image to slice plate crops from"""
+        self.roi_gray = cv2.cvtColor(roi, cv2.COLOR_BGR2GRAY, dst=self.roi_gray)
+        self.roi_blur = cv2.GaussianBlur(self.roi_gray, (5, 5), 0, dst=self.roi_blur)
+        return self.roi_blur
+
+    def threshold_plate(self, blur_crop):
+        """
+        Binarise a blurred plate crop with a local Gaussian adaptive threshold
+        into the shared scratch buffer. The returned view is overwritten by the next call.
+        """
+        h, w = blur_crop.shape[:2]
+        if h > self.thresh_buf.shape[0] or w > self.thresh_buf.shape[1]:
+            self.thresh_buf = np.empty((max(h, self.thresh_buf.shape[0]),
+                                        max(w, self.thresh_buf.shape[1])), np.uint8)
+
+        return cv2.adaptiveThreshold(blur_crop, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY,
+                                     THRESH_BLOCK_SIZE, THRESH_C, dst=self.thresh_buf[:h, :w])
+
+    def read_plate_text(self, thresh):
+        """
+        OCR a binarised plate crop as a single word and return it as ASCII bytes
+        with all whitespace removed.
+        Uses the persistent tesserocr API when installed, pytesseract otherwise.
+        """
+        if self.ocr is not None:
+            self.ocr.SetImage(Image.fromarray(thresh))
+            raw = self.ocr.GetUTF8Text().encode('ascii', 'ignore')
+        else:
+            raw = pytesseract.image_to_string(thresh, config=TESS_CONFIG,
+                                              output_type=pytesseract.Output.BYTES)
+        return raw.translate(None, OCR_WHITESPACE)
+
+    def detect(self, frame):
+        """
+        Run YOLO on the frame's barrier ROI and OCR every detected plate.
+        Returns the annotated frame and a list of (plate or None, plate crop,
+        threshold copy) per box.
+        """
+        readings = []
+
+        # Plates only appear in the ROI when a car is at the barrier, so detect on that alone
+        roi = frame[ROI_Y0:ROI_Y1, ROI_X0:ROI_X1]
+        results = self.model.predict(roi, device=DEVICE, half=USE_HALF,
+                                     imgsz=MODEL_IMGSZ, verbose=False)
+        roi_blur = None
+        for result in results:
+            crops = extract_crops(result.boxes.xyxy.cpu().numpy(), roi.shape[0], roi.shape[1])
+            for x1, y1, x2, y2 in crops.tolist():
+                # Grey/blur the ROI on the first box, then slice it per box
+                if roi_blur is None:
+                    roi_blur = self.preprocess_roi(roi)
+                thresh = self.threshold_plate(roi_blur[y1:y2, x1:x2])
+
+                match = self.plate_pattern.search(self.read_plate_text(thresh))
+                plate = match.group(1).decode('ascii') if match else None
+
+                # Map ROI coordinates back onto the full frame
+                plate_img = frame[y1 + ROI_Y0:y2 + ROI_Y0, x1 + ROI_X0:x2 + ROI_X0]
+                readings.append((plate, plate_img, thresh.copy()))  # thresh is reused by the next crop
+
+        annotated_frame = frame
+        if results:
+            annotated_frame = frame.copy()
+            annotated_frame[ROI_Y0:ROI_Y1, ROI_X0:ROI_X1] = results[0].plot()
+        return annotated_frame, readings
+
+    def vote(self, plate):
+        """Add a plate reading; returns the majority plate once the buffer is full, else None"""
+        self.plate_buffer.append(plate)
+        if len(self.plate_buffer) < self.buffer_size:
+            return None
+
+        if self.buffer_size == 3:
+            p0, p1, p2 = self.plate_buffer
+            most_common = p0 if (p0 == p1 or p0 == p2) else (p1 if p1 == p2 else p2)
+        else:
+            most_common, _ = Counter(self.plate_buffer).most_common(1)[0]
+        self.plate_buffer.clear()
+        return most_common
+
+    def close(self):
+        if self.ocr is not None:
+            self.ocr.End()
+
+# ===== Payment Lookups =====
+class PaymentStore:
+    """
+    Payment and entry-time lookups over plates_log.csv.
+    The CSV stays the record shared with car_entry.py, payment.py and the dashboard.
+    Only rows appended since the last look are parsed; rows still unpaid keep the byte
+    offset of their status field, so payment.py's in-place flips are picked up by
+    re-reading those bytes. A payment check is one lookup in the set of paid plates.
+    """
+
+    def __init__(self, csv_file):
+        self.csv_file = csv_file
+        self.paid_plates = frozenset()
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        """Forget everything read so the next sync re-reads the CSV from the start"""
+        self.first_entry = {}   # plate -> Timestamp of its first logged entry
+        self.paid_plates = frozenset()
+        self._unpaid = {}       # byte offset of an unpaid row's status field -> plate
+        self._columns = None    # (plate, status, timestamp) column positions from the header
+        self._offset = 0        # Length of the complete lines already read
+        self._inode = None
+        self._mtime = None
+
+    def _read_lines(self, data, offset):
+        """Record the rows in a block of complete CSV lines that starts at byte offset"""
+        paid = set()
+        for line in data.splitlines(keepends=True):
+            fields = line.rstrip(b'\r\n').split(b',')
+            if self._columns is None:
+                self._columns = (fields.index(b'Plate Number'), fields.index(b'Payment Status'),
+                                 fields.index(b'Timestamp'))
+            elif len(fields) > max(self._columns):
+                plate_idx, status_idx, ts_idx = self._columns
+                plate = fields[plate_idx].decode()
+                self.first_entry.setdefault(plate, fields[ts_idx].decode())
+                if fields[status_idx] == b'1':
+                    paid.add(plate)
+                else:
+                    # Every field before Payment Status plus its comma
+                    self._unpaid[offset + sum(len(f) + 1 for f in fields[:status_idx])] = plate
+            offset += len(line)
+        return paid
+
+    def _sync(self):
+        """Catch up with rows appended and statuses flipped since the last sync"""
+        st = os.stat(self.csv_file)
+        if st.st_mtime_ns == self._mtime and st.st_ino == self._inode:
+            return
+        # A replaced or shrunken file was rewritten; start over
+        if st.st_ino != self._inode or st.st_size < self._offset:
+            self._reset()
+
+        with open(self.csv_file, 'rb') as f:
+            fd = f.fileno()
+            paid = set()
+            for offset, plate in list(self._unpaid.items()):
+                if os.pread(fd, 1, offset) == b'1':
+                    paid.add(plate)
+                    del self._unpaid[offset]
+
+            data = os.pread(fd, st.st_size - self._offset, self._offset)
+            end = data.rfind(b'\n') + 1  # Leave a partly written last row for next time
+            paid |= self._read_lines(data[:end], self._offset)
+            self._offset += end
+
+        if paid - self.paid_plates:
+            self.paid_plates = self.paid_plates | paid
+        self._inode = st.st_ino
+        self._mtime = st.st_mtime_ns
+
+    def is_paid(self, plate_number):
+        """True if any session of the plate is marked paid"""
+        with self._lock:
+            self._sync()
+        return plate_number in self.paid_plates
+
+    def entry_time(self, plate_number):
+        """Timestamp of the plate's first logged entry, or None"""
+        with self._lock:
+            self._sync()
+        return self.first_entry.get(plate_number)
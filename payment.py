@@ -1,37 +1,345 @@
-import math
 import serial
+import serial.tools.list_ports
 import csv
+import calendar
 from datetime import datetime, timedelta
 import os
 import time
-import glob
+import select
+import threading
+import sqlite3
+import logging
+import logging.handlers
+from collections import defaultdict
+from array import array
+from functools import lru_cache
+from cpu_affinity import pin_to_cpus
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Diagnostics collect in a MemoryHandler and are written out together once each
+# message has been answered, so console writes stay off the serial reply path
+log = logging.getLogger('payment')
+log.setLevel(os.environ.get('LOG_LEVEL', 'INFO').upper())
+log.propagate = False
+_log_stream = logging.StreamHandler()
+_log_stream.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(message)s'))
+log_buffer = logging.handlers.MemoryHandler(1000, flushLevel=logging.ERROR, target=_log_stream)
+log.addHandler(log_buffer)
 
 # Configuration
 CSV_FILE = 'plates_log.csv'
 HOURLY_RATE = 500       # RWF per hour
 MINIMUM_CHARGE = 500    # Always charge 500 RWF minimum for any parking
 FREE_MINUTES = 0        # No free time - charge from first minute
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+PAYMENTS_DB = 'payments.db'
+PAYMENT_LOG = 'payment_log.txt'
+SERIAL_WAIT = 1.0       # Longest a read blocks in select() waiting for the Arduino
+RECONNECT_DELAY = 2     # Seconds between reconnect attempts after the Arduino disappears
+# Opt-in: CPUs the payment loop is pinned to (e.g. "0" or "2-3", unset leaves affinity
+# alone) and its SCHED_FIFO priority (0 or unset keeps the normal scheduler); both trade
+# a little flexibility for steadier serial latency
+PAYMENT_CPUS = os.environ.get('PAYMENT_CPUS', '')
+PAYMENT_RT_PRIORITY = os.environ.get('PAYMENT_RT_PRIORITY', '0')
+# USB vendor IDs of Arduino boards and the usual USB-serial bridges (CH340, FTDI, CP210x)
+ARDUINO_VIDS = {0x2341, 0x2A03, 0x1A86, 0x0403, 0x10C4}
 
 def find_arduino_port():
-    """Automatically find the Arduino port"""
-    possible_ports = ['/dev/ttyACM0', '/dev/ttyACM1', '/dev/ttyUSB0', '/dev/ttyUSB1']
-    possible_ports.extend(glob.glob('/dev/ttyACM*'))
-    possible_ports.extend(glob.glob('/dev/ttyUSB*'))
-    
-    for port in list(set(possible_ports)):
+    """Find the Arduino by USB vendor ID, falling back to any ttyACM/ttyUSB port"""
+    ports = serial.tools.list_ports.comports()
+    candidates = [p.device for p in ports if p.vid in ARDUINO_VIDS]
+    candidates.extend(p.device for p in ports if p.device not in candidates
+                      and ('ttyACM' in p.device or 'ttyUSB' in p.device))
+
+    for port in candidates:
         try:
-            print(f"🔌 Trying {port}...")
-            ser = serial.Serial(port, 9600, timeout=1)
-            time.sleep(2)
+            log.info("🔌 Trying %s...", port)
+            ser = serial.Serial(baudrate=9600, timeout=1)
+            ser.port = port
+            ser.dtr = False  # Don't pulse DTR on open, which resets the board
+            ser.open()
             if ser.is_open:
-                print(f"✅ Found Arduino on {port}")
+                log.info("✅ Found Arduino on %s", port)
                 return ser
         except (serial.SerialException, OSError):
             continue
-    
-    print("❌ No Arduino found")
+
+    log.error("❌ No Arduino found")
     return None
 
+def enable_low_latency(ser):
+    """
+    Set ASYNC_LOW_LATENCY on the tty (TIOCGSERIAL/TIOCSSERIAL) so USB-serial adapters
+    hand bytes over in ~1ms instead of batching them for up to 16ms
+    """
+    if not hasattr(ser, 'set_low_latency_mode'):
+        return
+    try:
+        ser.set_low_latency_mode(True)
+        log.info("⚡ Low-latency serial mode enabled")
+    except (IOError, OSError, ValueError) as e:
+        log.info("ℹ️ Low-latency serial mode not available: %s", e)
+
+def reconnect_arduino(ser):
+    """Close a dead port and retry find_arduino_port() every RECONNECT_DELAY seconds until it succeeds"""
+    try:
+        ser.close()
+    except Exception:
+        pass
+    serial_buffer.clear()
+    while True:
+        time.sleep(RECONNECT_DELAY)
+        ser = find_arduino_port()
+        log_buffer.flush()
+        if ser:
+            enable_low_latency(ser)
+            return ser
+
+def set_realtime_scheduling():
+    """
+    Pin the process to PAYMENT_CPUS and move it to SCHED_FIFO so a tty wakeup is
+    serviced at once. Both are opt-in; bad settings are logged and skipped.
+    SCHED_FIFO needs CAP_SYS_NICE; without it the normal scheduler stays.
+    """
+    if PAYMENT_CPUS and hasattr(os, 'sched_setaffinity'):
+        try:
+            if not pin_to_cpus(PAYMENT_CPUS):
+                log.warning("⚠️ PAYMENT_CPUS=%s names no usable CPU, affinity unchanged", PAYMENT_CPUS)
+        except (ValueError, OSError) as e:
+            log.warning("⚠️ Could not pin to CPUs %s: %s", PAYMENT_CPUS, e)
+
+    try:
+        priority = int(PAYMENT_RT_PRIORITY or 0)
+    except ValueError:
+        log.warning("⚠️ Ignoring invalid PAYMENT_RT_PRIORITY=%s", PAYMENT_RT_PRIORITY)
+        priority = 0
+    if priority > 0 and hasattr(os, 'sched_setscheduler'):
+        try:
+            os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(priority))
+            log.info("⚡ SCHED_FIFO priority %d enabled", priority)
+        except (ValueError, OSError) as e:
+            log.info("ℹ️ SCHED_FIFO not available: %s", e)
+
+# ===== Unpaid Session Index =====
+# Every unpaid row of CSV_FILE gets a slot in these parallel columns, built once and
+# extended with rows appended since (car_entry.py appends)
+session_plates = []             # Plate Number
+session_status = bytearray()    # Payment Status byte, b'0' until paid here
+session_entry = array('q')      # Timestamp as epoch seconds
+session_offsets = array('q')    # Byte offset of the row's Payment Status field
+unpaid = defaultdict(list)      # plate -> slots of its sessions still unpaid; plates with
+                                # nothing left unpaid are removed, so its keys are the unpaid set
+_indexed_bytes = 0      # Length of the complete lines already indexed
+_columns = None         # (plate, status, timestamp) column positions from the header
+csv_fd = None           # CSV_FILE opened once for reading the index and flipping status bytes
+_csv_size = None        # st_size of CSV_FILE when it was last indexed
+
+def _reset_unpaid_index():
+    """Forget everything indexed so the next refresh re-reads CSV_FILE from the start"""
+    global _indexed_bytes, _columns, _csv_size
+    unpaid.clear()
+    del session_plates[:], session_entry[:], session_offsets[:]
+    session_status.clear()
+    _indexed_bytes = 0
+    _columns = None
+    _csv_size = None
+
+def csv_stat():
+    """
+    fstat the persistent CSV_FILE descriptor, opening it on first use.
+    Reopens (and drops the index) if the file was deleted or replaced since.
+    """
+    global csv_fd
+    if csv_fd is not None:
+        st = os.fstat(csv_fd)
+        if st.st_nlink:
+            return st
+        os.close(csv_fd)
+        csv_fd = None
+        _reset_unpaid_index()
+    csv_fd = os.open(CSV_FILE, os.O_RDWR)
+    return os.fstat(csv_fd)
+
+def close_csv():
+    """Close the persistent CSV_FILE descriptor"""
+    global csv_fd
+    if csv_fd is not None:
+        os.close(csv_fd)
+        csv_fd = None
+
+@lru_cache(maxsize=65536)
+def to_epoch(timestamp):
+    """Parse a CSV Timestamp (local time) into epoch seconds"""
+    # Fixed-width fast path for YYYY-MM-DD HH:MM:SS (separators at 4, 7, 10, 13, 16);
+    # anything else goes through strptime so bad rows still raise ValueError
+    if len(timestamp) == 19 and timestamp[4::3] == '-- ::':
+        year, month, day = int(timestamp[0:4]), int(timestamp[5:7]), int(timestamp[8:10])
+        hour, minute, second = int(timestamp[11:13]), int(timestamp[14:16]), int(timestamp[17:19])
+        # mktime rolls impossible dates forward (Feb 31 -> Mar 3), so check the month's length
+        if (1 <= month <= 12 and 1 <= day <= calendar.monthrange(year, month)[1]
+                and hour < 24 and minute < 60 and second < 60):
+            return int(time.mktime((year, month, day, hour, minute, second, 0, 0, -1)))
+    return int(datetime.strptime(timestamp, TIMESTAMP_FORMAT).timestamp())
+
+def to_timestamp(epoch):
+    """Format epoch seconds back into the CSV Timestamp format"""
+    return time.strftime(TIMESTAMP_FORMAT, time.localtime(epoch))
+
+def mark_paid(slot):
+    """Flip one session's status to paid in memory and in CSV_FILE; False if it already was"""
+    if session_status[slot] != ord('0'):
+        return False
+    session_status[slot] = ord('1')
+    offset = session_offsets[slot]
+    if os.pread(csv_fd, 1, offset) != b'0':
+        return False
+    os.pwrite(csv_fd, b'1', offset)
+    return True
+
+def _index_lines(data, offset):
+    """Index the unpaid rows in a block of complete CSV lines that starts at byte offset"""
+    global _columns
+    for line in data.splitlines(keepends=True):
+        fields = line.rstrip(b'\r\n').split(b',')
+        if _columns is None:
+            _columns = (fields.index(b'Plate Number'), fields.index(b'Payment Status'),
+                        fields.index(b'Timestamp'))
+        elif len(fields) > max(_columns):
+            plate_idx, status_idx, ts_idx = _columns
+            if fields[status_idx] == b'0':
+                timestamp = fields[ts_idx].decode()
+                try:
+                    entry_epoch = to_epoch(timestamp)
+                except ValueError as e:
+                    log.warning("   ⚠️ Date parsing error: %s", e)
+                else:
+                    plate = fields[plate_idx].decode()
+                    unpaid[plate].append(len(session_plates))
+                    session_plates.append(plate)
+                    session_status.append(fields[status_idx][0])
+                    session_entry.append(entry_epoch)
+                    # Every field before Payment Status plus its comma
+                    session_offsets.append(offset + sum(len(f) + 1 for f in fields[:status_idx]))
+        offset += len(line)
+
+def refresh_unpaid_index():
+    """
+    Index rows appended to CSV_FILE since the last call.
+    This process's own writes are in-place status flips that mark_paid() applies to
+    the index as it makes them, so only a change in size (car_entry.py appending)
+    means there is anything to read; rebuilds from scratch if the file shrank
+    (rewritten by hand or truncated).
+    """
+    global _indexed_bytes, _csv_size
+    st = csv_stat()
+    if st.st_size == _csv_size:
+        return
+    if st.st_size < _indexed_bytes:
+        _reset_unpaid_index()
+    _csv_size = st.st_size
+    if st.st_size == _indexed_bytes:
+        return
+
+    data = os.pread(csv_fd, st.st_size - _indexed_bytes, _indexed_bytes)
+    end = data.rfind(b'\n') + 1  # Leave a partly written last row for next time
+    _index_lines(data[:end], _indexed_bytes)
+    _indexed_bytes += end
+
+# ===== Payments Database =====
+# Every paid session is recorded in PAYMENTS_DB (SQLite, WAL) before its status byte is
+# flipped, so a flip lost to a crash is re-applied on the next start
+db = None
+
+def open_payments_db():
+    """Open PAYMENTS_DB and re-apply any recorded payment CSV_FILE still shows as unpaid"""
+    global db
+    db = sqlite3.connect(PAYMENTS_DB)
+    db.execute('PRAGMA journal_mode=WAL')
+    # Commits skip fsync; the sync thread's checkpoint makes them durable off the reply path
+    db.execute('PRAGMA synchronous=NORMAL')
+    db.execute('CREATE TABLE IF NOT EXISTS payments(plate TEXT, entry_ts INT, paid_at TEXT)')
+    db.execute('CREATE INDEX IF NOT EXISTS payments_plate_entry ON payments(plate, entry_ts)')
+
+    # Only plates the CSV still shows as unpaid can have a lost flip; look each one up
+    replayed = 0
+    for plate in list(unpaid):
+        slots = unpaid[plate]
+        paid = {entry_ts for entry_ts, in db.execute(
+            'SELECT entry_ts FROM payments WHERE plate=?', (plate,))}
+        if not paid:
+            continue
+        for slot in [slot for slot in slots if session_entry[slot] in paid]:
+            if mark_paid(slot):
+                replayed += 1
+            slots.remove(slot)
+        if not slots:
+            del unpaid[plate]
+    os.fsync(csv_fd)
+    if replayed:
+        log.info("🔁 Re-applied %d recorded payment(s) to %s", replayed, CSV_FILE)
+
+# ===== Background fsync =====
+# PAYMENTS_DB, CSV_FILE and the payment log are made durable on their own thread, so the
+# reply to the Arduino goes out without waiting on the disk; request_sync() just wakes it
+sync_requested = threading.Event()
+sync_stopping = False
+sync_thread = None
+
+def _sync_files(checkpoint_db):
+    """fsync every open durability-sensitive file"""
+    try:
+        # Syncs the WAL before copying it back, so every committed payment is on disk
+        checkpoint_db.execute('PRAGMA wal_checkpoint(PASSIVE)')
+    except sqlite3.Error as e:
+        log.warning("⚠️ Checkpoint error: %s", e)
+    if payment_log is not None and not payment_log.closed:
+        try:
+            os.fsync(payment_log.fileno())
+        except OSError as e:
+            log.warning("⚠️ fsync error: %s", e)
+    if csv_fd is not None:
+        try:
+            os.fsync(csv_fd)
+        except OSError as e:
+            log.warning("⚠️ fsync error: %s", e)
+
+def _sync_worker():
+    """Run one fsync pass per batch of requests until stop_sync_thread()"""
+    # SQLite connections belong to the thread that opened them, so checkpoint through our own
+    checkpoint_db = sqlite3.connect(PAYMENTS_DB)
+    try:
+        while True:
+            sync_requested.wait()
+            sync_requested.clear()
+            _sync_files(checkpoint_db)
+            if sync_stopping:
+                return
+    finally:
+        checkpoint_db.close()
+
+def request_sync():
+    """Ask the sync thread to flush the payment files to disk"""
+    sync_requested.set()
+
+def start_sync_thread():
+    """Start the background fsync thread"""
+    global sync_thread
+    sync_thread = threading.Thread(target=_sync_worker, daemon=True)
+    sync_thread.start()
+
+def stop_sync_thread():
+    """Run a last fsync pass and wait for the sync thread, before the files are closed"""
+    global sync_stopping
+    if sync_thread is None:
+        return
+    sync_stopping = True
+    sync_requested.set()
+    sync_thread.join()
+
 def calculate_charges(plate_number):
     """Calculate charges with 500 RWF minimum for any parking session"""
     if not os.path.exists(CSV_FILE):
@@ -39,141 +347,291 @@ def calculate_charges(plate_number):
 
     total_charge = 0
     unpaid_sessions = 0
-    total_duration_minutes = 0
-    current_time = datetime.now()
+    total_duration_seconds = 0
+    current_time = int(time.time())
 
-    print(f"💰 Calculating charges for {plate_number}...")
+    log.info("💰 Calculating charges for %s...", plate_number)
 
     try:
-        with open(CSV_FILE, 'r') as file:
-            reader = csv.DictReader(file)
-            for row in reader:
-                if row['Plate Number'] == plate_number and row['Payment Status'] == '0':
-                    try:
-                        entry_time = datetime.strptime(row['Timestamp'], '%Y-%m-%d %H:%M:%S')
-                        duration = current_time - entry_time
-                        minutes = duration.total_seconds() / 60
-                        total_duration_minutes += minutes
-                        
-                        print(f"   📅 Session: {entry_time} → {minutes:.1f} minutes")
-                        
-                        # Calculate charge for this session
-                        if minutes > 0:  # Any parking time gets charged
-                            # Round up to nearest hour for additional charges beyond first 500
-                            hours = math.ceil(minutes / 60)
-                            session_charge = max(hours * HOURLY_RATE, MINIMUM_CHARGE)
-                            total_charge += session_charge
-                            unpaid_sessions += 1
-                            
-                            print(f"   💸 Session charge: {session_charge} RWF ({hours} hour(s))")
-                        
-                    except ValueError as e:
-                        print(f"   ⚠️ Date parsing error: {e}")
-                        continue
+        refresh_unpaid_index()
+        # Already paid (the common exit tap): nothing to price
+        if plate_number not in unpaid:
+            log.info("📊 Summary: 0 sessions, 0 RWF total")
+            return 0, 0, "No active sessions"
+
+        slots = unpaid[plate_number]
+        entry_times = [session_entry[slot] for slot in slots]
+
+        # Minutes parked and charge for every session in one pass; numpy when available
+        # Round up to nearest hour for additional charges beyond first 500, using integer
+        # ceiling division on whole seconds
+        if np is not None and slots:
+            seconds = current_time - np.frombuffer(session_entry, dtype=np.int64)[slots]
+            hours = -(-seconds // 3600)
+            charges = np.where(seconds > 0, np.maximum(hours * HOURLY_RATE, MINIMUM_CHARGE), 0)
+            seconds, hours, charges = seconds.tolist(), hours.tolist(), charges.tolist()
+        else:
+            seconds = [current_time - entry_time for entry_time in entry_times]
+            hours = [-(-s // 3600) for s in seconds]
+            charges = [max(h * HOURLY_RATE, MINIMUM_CHARGE) if s > 0 else 0
+                       for s, h in zip(seconds, hours)]
+
+        for entry_time, session_seconds, session_hours, session_charge in zip(
+                entry_times, seconds, hours, charges):
+            total_duration_seconds += session_seconds
+            log.info("   📅 Session: %s → %.1f minutes", to_timestamp(entry_time), session_seconds / 60)
+
+            # Any parking time gets charged
+            if session_seconds > 0:
+                total_charge += session_charge
+                unpaid_sessions += 1
+                log.info("   💸 Session charge: %s RWF (%s hour(s))", session_charge, session_hours)
 
         # Format duration string
-        if total_duration_minutes > 0:
-            hours = int(total_duration_minutes // 60)
-            minutes = int(total_duration_minutes % 60)
-            duration_str = f"{hours}:{minutes:02d}:00"
+        if total_duration_seconds > 0:
+            hours, rest = divmod(total_duration_seconds, 3600)
+            minutes, secs = divmod(rest, 60)
+            duration_str = "%d:%02d:%02d" % (hours, minutes, secs)
         else:
             duration_str = "No active sessions"
 
-        print(f"📊 Summary: {unpaid_sessions} sessions, {total_charge} RWF total")
+        log.info("📊 Summary: %d sessions, %s RWF total", unpaid_sessions, total_charge)
         return total_charge, unpaid_sessions, duration_str
 
     except Exception as e:
-        print(f"❌ Error calculating charges: {e}")
+        log.error("❌ Error calculating charges: %s", e)
         return 0, 0, "Calculation error"
 
-def update_csv(plate_number):
-    """Update payment status for all unpaid sessions"""
+def update_csv(plate_number, refresh=True):
+    """
+    Update payment status for all unpaid sessions.
+    refresh=False pays exactly the sessions the index held when they were priced.
+    """
     if not os.path.exists(CSV_FILE):
         return False
 
     try:
-        updated_rows = []
+        if refresh:
+            refresh_unpaid_index()
         sessions_updated = 0
 
-        with open(CSV_FILE, 'r') as file:
-            reader = csv.DictReader(file)
-            fieldnames = reader.fieldnames
-            for row in reader:
-                if row['Plate Number'] == plate_number and row['Payment Status'] == '0':
-                    row['Payment Status'] = '1'  # Mark as paid
-                    sessions_updated += 1
-                updated_rows.append(row)
+        slots = unpaid.get(plate_number, ())
+        paid_at = datetime.now().strftime(TIMESTAMP_FORMAT)
 
-        with open(CSV_FILE, 'w', newline='') as file:
-            writer = csv.DictWriter(file, fieldnames=fieldnames)
-            writer.writeheader()
-            writer.writerows(updated_rows)
+        # Record the payment first, then flip each '0' status byte to '1' in place; the CSV
+        # is never rewritten, so rows appended concurrently by car_entry.py are not lost.
+        # The plate leaves the unpaid index only once the record has committed, so a
+        # failed insert leaves its sessions payable on the next tap
+        if db is not None:
+            with db:
+                db.executemany('INSERT INTO payments VALUES (?, ?, ?)',
+                               [(plate_number, session_entry[slot], paid_at) for slot in slots])
+        unpaid.pop(plate_number, None)
 
-        print(f"✅ Updated {sessions_updated} sessions to PAID")
+        for slot in slots:
+            if mark_paid(slot):
+                sessions_updated += 1
+
+        log.info("✅ Updated %d sessions to PAID", sessions_updated)
         return True
 
     except Exception as e:
-        print(f"❌ Error updating CSV: {e}")
+        log.error("❌ Error updating CSV: %s", e)
         return False
 
+def charge_and_pay(plate_number, balance):
+    """
+    Price a plate's unpaid sessions and, if balance covers them, mark those same
+    sessions paid, all from one refresh of the index.
+    Returns (total_charge, sessions, duration, paid); paid is None when no payment
+    was attempted, otherwise update_csv's result.
+    """
+    total_charge, sessions, duration = calculate_charges(plate_number)
+    if sessions == 0 or balance < total_charge:
+        return total_charge, sessions, duration, None
+    return total_charge, sessions, duration, update_csv(plate_number, refresh=False)
+
 def process_payment(plate_number, current_balance):
     """Process payment with 500 RWF minimum charge"""
     try:
-        print(f"\n💳 Processing payment for {plate_number} (Balance: {current_balance} RWF)")
+        log.info("💳 Processing payment for %s (Balance: %s RWF)", plate_number, current_balance)
         
-        total_charge, sessions, duration = calculate_charges(plate_number)
+        total_charge, sessions, duration, paid = charge_and_pay(plate_number, current_balance)
 
         if sessions == 0:
-            print(f"✅ No unpaid parking sessions for {plate_number}")
+            log.info("✅ No unpaid parking sessions for %s", plate_number)
             return "NO_PARKING_SESSIONS", current_balance, duration
 
-        print(f"💰 Total charge: {total_charge} RWF for {sessions} session(s)")
-        print(f"⏱️ Duration: {duration}")
+        log.info("💰 Total charge: %s RWF for %d session(s)", total_charge, sessions)
+        log.info("⏱️ Duration: %s", duration)
 
-        if current_balance < total_charge:
+        if paid is None:
             shortage = total_charge - current_balance
-            print(f"❌ Insufficient funds: Need {total_charge}, have {current_balance} (short {shortage})")
+            log.warning("❌ Insufficient funds: Need %s, have %s (short %s)", total_charge, current_balance, shortage)
             return f"INSUFFICIENT_FUNDS:{total_charge},{current_balance}", current_balance, duration
 
-        # Process payment
+        # charge_and_pay has already marked the sessions paid
         new_balance = current_balance - total_charge
-        
-        if update_csv(plate_number):
-            print(f"✅ Payment successful: {total_charge} RWF charged, new balance: {new_balance} RWF")
+
+        if paid:
+            log.info("✅ Payment successful: %s RWF charged, new balance: %s RWF", total_charge, new_balance)
             return "PAYMENT_SUCCESS", new_balance, duration
         else:
-            print(f"❌ Failed to update payment records")
+            log.error("❌ Failed to update payment records")
             return "UPDATE_ERROR", current_balance, duration
 
     except Exception as e:
         error_msg = f"PROCESSING_ERROR: {str(e)}"
-        print(f"❌ {error_msg}")
+        log.error("❌ %s", error_msg)
         return error_msg, current_balance, "Error"
 
+# Bytes drained from the Arduino but not yet split into lines
+serial_buffer = bytearray()
+
 def safe_serial_read(ser):
-    """Safely read from serial with error handling"""
+    """
+    Safely read one line from serial with error handling.
+    Everything the tty has queued is drained in a single read and split on newlines,
+    so a burst of messages is served from serial_buffer without further syscalls.
+    Raises serial.SerialException when the port fails or reads nothing after reporting
+    readiness (Arduino unplugged), so the caller reconnects instead of spinning.
+    """
     try:
-        if ser.in_waiting > 0:
-            line = ser.readline().decode('utf-8', errors='ignore').strip()
-            return line
+        if b'\n' not in serial_buffer:
+            # Sleep in select() until the tty is readable; the kernel wakes us as bytes arrive
+            try:
+                if os.name == 'posix':
+                    ready, _, _ = select.select([ser], [], [], SERIAL_WAIT)
+                    if not ready:
+                        return None
+                elif ser.in_waiting == 0:
+                    time.sleep(0.05)  # Small delay to prevent CPU overload
+                    return None
+                data = ser.read(ser.in_waiting or 1)
+            except (serial.SerialException, OSError) as e:
+                raise serial.SerialException(f"Arduino disconnected: {e}") from e
+            if not data:
+                raise serial.SerialException("Arduino disconnected: readable but no data")
+            serial_buffer.extend(data)
+
+        end = serial_buffer.find(b'\n')
+        if end < 0:
+            return None  # Partial line; the rest arrives on a later read
+        line = serial_buffer[:end].decode('utf-8', errors='ignore').strip()
+        del serial_buffer[:end + 1]
+        return line
+    except serial.SerialException:
+        raise
     except Exception as e:
-        print(f"⚠️ Read error: {e}")
+        log.warning("⚠️ Read error: %s", e)
         return None
-    return None
 
-def safe_serial_write(ser, message):
-    """Safely write to serial with error handling"""
+# Fixed replies, encoded once
+RESP_NO_SESSIONS = b"NO_PARKING_SESSIONS\n"
+RESP_INVALID_DATA = b"ERROR:Invalid data format\n"
+RESP_INVALID_BALANCE = b"ERROR:Invalid balance format\n"
+RESP_PROCESSING_FAILED = b"ERROR:Processing failed\n"
+
+def safe_serial_write(ser, response):
+    """
+    Safely write a newline-terminated reply (bytes) to serial with error handling.
+    Goes straight to the tty fd with os.write, skipping pyserial's per-call overhead.
+    """
     try:
-        response = f"{message}\n".encode('utf-8')
-        ser.write(response)
-        print(f"📤 Sent: {message}")
+        if os.name == 'posix':
+            pending = memoryview(response)
+            try:
+                while pending:
+                    pending = pending[os.write(ser.fileno(), pending):]
+            except BlockingIOError:
+                ser.write(pending)  # tty buffer full; let pyserial wait for room
+        else:
+            ser.write(response)
+        log.info("📤 Sent: %s", response[:-1].decode('utf-8', errors='ignore'))
         return True
     except Exception as e:
-        print(f"❌ Write error: {e}")
+        log.error("❌ Write error: %s", e)
         return False
 
+# ===== Message Handlers =====
+# Transaction log, opened once in main() and line-buffered so each entry is written through
+payment_log = None
+
+def handle_payment_request(payload, ser):
+    """Charge a plate's unpaid sessions for PROCESS_PAYMENT/CALCULATE_PAYMENT:<plate>,<balance>"""
+    try:
+        data = payload.split(',')
+        if len(data) >= 2:
+            plate_number = data[0].strip()
+            current_balance = int(data[1].strip())
+
+            # Process payment
+            status, new_balance, duration = process_payment(plate_number, current_balance)
+
+            # Send appropriate response based on status
+            if status == "PAYMENT_SUCCESS":
+                charged_amount = current_balance - new_balance
+                safe_serial_write(ser, b"PAYMENT_SUCCESS:%d,%d,%s\n" % (new_balance, charged_amount, duration.encode()))
+
+            elif status.startswith("INSUFFICIENT_FUNDS:"):
+                safe_serial_write(ser, status.encode() + b"\n")
+
+            elif status == "NO_PARKING_SESSIONS":
+                safe_serial_write(ser, RESP_NO_SESSIONS)
+
+            else:
+                safe_serial_write(ser, b"ERROR:%s\n" % status.encode())
+
+            # Log transaction
+            timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+            if status == "PAYMENT_SUCCESS":
+                charged_amount = current_balance - new_balance
+                log_entry = f"{timestamp} - {plate_number} - SUCCESS: Charged {charged_amount} RWF for {duration} parking, Balance: {current_balance} → {new_balance} RWF"
+            elif status.startswith("INSUFFICIENT_FUNDS:"):
+                parts = status.split(':')[1].split(',')
+                required = parts[0] if len(parts) > 0 else "Unknown"
+                log_entry = f"{timestamp} - {plate_number} - INSUFFICIENT_FUNDS: Required {required} RWF, Available {current_balance} RWF"
+            elif status == "NO_PARKING_SESSIONS":
+                log_entry = f"{timestamp} - {plate_number} - NO_PARKING_SESSIONS: No unpaid sessions found"
+            else:
+                log_entry = f"{timestamp} - {plate_number} - ERROR: {status}"
+
+            log.info("📝 %s", log_entry)
+
+            try:
+                payment_log.write(log_entry + '\n')
+            except Exception as e:
+                log.warning("⚠️ Log write error: %s", e)
+
+            # The reply is already on the wire; make the payment, CSV and log durable behind it
+            request_sync()
+
+        else:
+            log.warning("❌ Invalid data format: %s", payload)
+            safe_serial_write(ser, RESP_INVALID_DATA)
+
+    except ValueError as e:
+        log.warning("❌ Value error: %s", e)
+        safe_serial_write(ser, RESP_INVALID_BALANCE)
+    except Exception as e:
+        log.error("❌ Processing error: %s", e)
+        safe_serial_write(ser, RESP_PROCESSING_FAILED)
+
+def handle_insufficient_balance(payload, ser):
+    """Report an INSUFFICIENT_BALANCE:<balance> notice from the Arduino"""
+    log.warning("⚠️ Insufficient balance detected: %s", payload)
+
+# Message type (text before the first ':') -> handler(payload, ser)
+HANDLERS = {
+    'PROCESS_PAYMENT': handle_payment_request,
+    'CALCULATE_PAYMENT': handle_payment_request,
+    'INSUFFICIENT_BALANCE': handle_insufficient_balance,
+}
+
 def main():
     """Main payment processing loop"""
+    global payment_log
     print("🏧 PARKING PAYMENT SYSTEM")
     print("=" * 50)
     print(f"💰 Hourly Rate: {HOURLY_RATE} RWF")
@@ -181,11 +639,23 @@ def main():
     print(f"⚡ Policy: ANY parking session = {MINIMUM_CHARGE} RWF minimum")
     print("=" * 50)
 
+    # Before any thread is started, so the sync thread inherits the same placement
+    set_realtime_scheduling()
+
+    # Open CSV_FILE once and index unpaid sessions; later calls only read rows appended since
+    refresh_unpaid_index()
+    open_payments_db()
+    payment_log = open(PAYMENT_LOG, 'a', buffering=1)
+    start_sync_thread()
+
     # Initialize serial connection
     ser = find_arduino_port()
     if not ser:
+        log_buffer.flush()
         print("❌ Cannot start without Arduino connection")
         return
+    enable_low_latency(ser)
+    log_buffer.flush()
 
     print("✅ Payment System Running. Waiting for RFID scans...")
     print("🛑 Press Ctrl+C to stop\n")
@@ -193,93 +663,45 @@ def main():
     while True:
         try:
             line = safe_serial_read(ser)
-            
+
             if line:
-                print(f"📨 Received: '{line}'")
-
-                # Handle both PROCESS_PAYMENT and CALCULATE_PAYMENT formats
-                if line.startswith("PROCESS_PAYMENT:") or line.startswith("CALCULATE_PAYMENT:"):
-                    try:
-                        # Extract data based on prefix
-                        if line.startswith("CALCULATE_PAYMENT:"):
-                            data = line[18:].split(',')  # Remove "CALCULATE_PAYMENT:"
-                        else:
-                            data = line[16:].split(',')  # Remove "PROCESS_PAYMENT:"
-                        
-                        if len(data) >= 2:
-                            plate_number = data[0].strip()
-                            current_balance = int(data[1].strip())
-
-                            # Process payment
-                            status, new_balance, duration = process_payment(plate_number, current_balance)
-
-                            # Send appropriate response based on status
-                            if status == "PAYMENT_SUCCESS":
-                                charged_amount = current_balance - new_balance
-                                safe_serial_write(ser, f"PAYMENT_SUCCESS:{new_balance},{charged_amount},{duration}")
-                                
-                            elif status.startswith("INSUFFICIENT_FUNDS:"):
-                                safe_serial_write(ser, status)
-                                
-                            elif status == "NO_PARKING_SESSIONS":
-                                safe_serial_write(ser, "NO_PARKING_SESSIONS")
-                                
-                            else:
-                                safe_serial_write(ser, f"ERROR:{status}")
-
-                            # Log transaction
-                            timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                            
-                            if status == "PAYMENT_SUCCESS":
-                                charged_amount = current_balance - new_balance
-                                log_entry = f"{timestamp} - {plate_number} - SUCCESS: Charged {charged_amount} RWF for {duration} parking, Balance: {current_balance} → {new_balance} RWF"
-                            elif status.startswith("INSUFFICIENT_FUNDS:"):
-                                parts = status.split(':')[1].split(',')
-                                required = parts[0] if len(parts) > 0 else "Unknown"
-                                log_entry = f"{timestamp} - {plate_number} - INSUFFICIENT_FUNDS: Required {required} RWF, Available {current_balance} RWF"
-                            elif status == "NO_PARKING_SESSIONS":
-                                log_entry = f"{timestamp} - {plate_number} - NO_PARKING_SESSIONS: No unpaid sessions found"
-                            else:
-                                log_entry = f"{timestamp} - {plate_number} - ERROR: {status}"
-
-                            print(f"📝 {log_entry}")
-                            
-                            try:
-                                with open('payment_log.txt', 'a') as log_file:
-                                    log_file.write(log_entry + '\n')
-                            except Exception as e:
-                                print(f"⚠️ Log write error: {e}")
-
-                        else:
-                            print(f"❌ Invalid data format: {line}")
-                            safe_serial_write(ser, "ERROR:Invalid data format")
-                            
-                    except ValueError as e:
-                        print(f"❌ Value error: {e}")
-                        safe_serial_write(ser, "ERROR:Invalid balance format")
-                    except Exception as e:
-                        print(f"❌ Processing error: {e}")
-                        safe_serial_write(ser, f"ERROR:Processing failed")
-
-                elif line.startswith("INSUFFICIENT_BALANCE:"):
-                    balance = line[len("INSUFFICIENT_BALANCE:"):]
-                    print(f"⚠️ Insufficient balance detected: {balance}")
-
-                elif line:  # Any other message
-                    print(f"ℹ️ Info: {line}")
-
-            time.sleep(0.05)  # Small delay to prevent CPU overload
+                log.info("📨 Received: '%s'", line)
+
+                # One split and one dict lookup instead of a chain of prefix checks
+                cmd, sep, payload = line.partition(':')
+                handler = HANDLERS.get(cmd) if sep else None
+                if handler:
+                    handler(payload, ser)
+                else:  # Any other message
+                    log.info("ℹ️ Info: %s", line)
+                log_buffer.flush()
 
         except KeyboardInterrupt:
             print("\n🛑 Shutting down payment system...")
             break
-            
+
+        except serial.SerialException as e:
+            log.error("❌ %s; reconnecting...", e)
+            log_buffer.flush()
+            try:
+                ser = reconnect_arduino(ser)
+            except KeyboardInterrupt:
+                print("\n🛑 Shutting down payment system...")
+                break
+
         except Exception as e:
-            print(f"❌ Error: {str(e)}")
+            log.error("❌ Error: %s", e)
             time.sleep(1)
             continue
 
     # Cleanup
+    log_buffer.flush()
+    stop_sync_thread()
+    if db is not None:
+        db.close()
+    if payment_log is not None:
+        payment_log.close()
+    close_csv()
     try:
         if ser and ser.is_open:
             ser.close()
@@ -0,0 +1,57 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+
+import payment
+
+
+class LockedDatabase:
+    """Stands in for payments.db when another connection holds the write lock"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def executemany(self, sql, rows):
+        raise sqlite3.OperationalError('database is locked')
+
+
+class UpdateCsvTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.csv_file = os.path.join(self.tmp.name, 'plates_log.csv')
+        with open(self.csv_file, 'w', newline='') as f:
+            f.write('Plate Number,Payment Status,Timestamp\n'
+                    'RAB123A,0,2026-10-15 08:00:00\n')
+        self.saved = payment.CSV_FILE, payment.db
+        payment.CSV_FILE = self.csv_file
+        payment.close_csv()
+        payment._reset_unpaid_index()
+
+    def tearDown(self):
+        payment.log_buffer.flush()
+        payment.close_csv()
+        payment._reset_unpaid_index()
+        payment.CSV_FILE, payment.db = self.saved
+        self.tmp.cleanup()
+
+    def test_failed_payment_record_keeps_sessions_unpaid(self):
+        payment.db = LockedDatabase()
+        self.assertFalse(payment.update_csv('RAB123A'))
+        self.assertIn('RAB123A', payment.unpaid)
+
+        payment.db = None
+        total, sessions, _ = payment.calculate_charges('RAB123A')
+        self.assertEqual(sessions, 1)
+        self.assertTrue(payment.update_csv('RAB123A'))
+        self.assertNotIn('RAB123A', payment.unpaid)
+        with open(self.csv_file) as f:
+            self.assertIn('RAB123A,1,', f.read())
+
+
+if __name__ == '__main__':
+    unittest.main()